@@ -2,45 +2,166 @@
 Guardian Bot — Full production-ready single-file
 
 Features:
-- Slash commands: /about, /enable_guard, /disable_guard, /set_log_channel
-- Persistent JSON config (config.json) stored atomically (aiofiles)
-- Embed-based persistent control panel message (admins only)
+- Slash commands: /about, /enable_guard, /disable_guard, /set_log_channel, /link_domains, /nuke_threshold, /raid_settings, /guard_stats, /unlock
+- Persistent config (write-behind, batched flushes): SQLite (WAL, per-guild rows) or JSON (config.json, atomic via aiofiles)
+- Embed-based persistent control panel message (admins only), debounced and render-cached;
+  buttons are routed by one stateless DynamicItem, so they keep working after restarts
 - Antinuke protections (channels/roles/webhooks create/delete, member bans/kicks, bots added)
-- AutoMod protections (link/invite filtering, mass-mention protection)
-- Safe punishments: remove roles, kick, ban, lockdown, unverified account ban, notify admins
-- Per-guild whitelist (antinuke and automod)
-- Rate-limiting for triggers
-- Uses interaction.defer + followup to avoid "Unknown interaction"
-- Flask keep-alive endpoint for Render / UptimeRobot
+  plus a weighted per-actor nuke score across all of them
+- Join raid detection (per-guild join-rate window + account-age histogram) with budgeted bulk ban/timeout of young accounts
+- AutoMod protections (compiled link/invite filter with allow/deny domains, mass-mention protection,
+  copy-paste flood detection from bounded per-author/per-channel fingerprint rings)
+- Priority-ordered REST actions (containment > lockdown > logging > panel edits)
+- Batched, non-blocking log delivery (up to 10 embeds per message, overflow summarized)
+- Safe punishments (one coalesced response + aggregated report per actor burst): remove roles, kick, ban, concurrent reversible lockdown (/unlock), unverified account ban, notify admins
+- Per-guild whitelist (antinuke and automod), compiled to id sets with memoized checks
+- Configurable client caches (MEMBER_CACHE, CHUNK_GUILDS_AT_STARTUP, MAX_MESSAGES); members outside
+  the cache are fetched on demand (single-flight) into a small LRU
+- In-memory sliding-window rate-limiting for triggers
+- Actor attribution from gateway audit-log events (coalesced REST audit-log fetch as fallback)
+- Uses interaction.defer + followup to avoid "Unknown interaction" (panel acks go out before any I/O)
+- Per-handler and per-stage latency percentiles (/guard_stats), opt-in sampling profiler
+- In-loop aiohttp liveness (/) and health (/health: gateway latency, shard status, event-loop lag) endpoints
+  and Prometheus /metrics
+- Auto-sharded; optional multi-process cluster (shard ranges per worker, shared SQLite, each worker
+  loading only its own guilds) with health and metrics aggregated per worker by the launcher
 - No audioop dependency
 Run:
   export TOKEN="your_bot_token"
   python bot.py
+  CLUSTER_WORKERS=4 python bot.py   # launcher: 4 worker processes, aggregated /health and /metrics on PORT
 """
 
 import os
+import sys
 import re
 import json
+import time
+import signal
+import string
+import sqlite3
+import enum
+import bisect
+import heapq
 import asyncio
-import datetime
+import functools
+import itertools
 import threading
-from typing import Any, Dict, Optional, List, Tuple
+import contextvars
+import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, List, Literal, Tuple
 
 import aiofiles
 import discord
 from discord import app_commands
 from discord.ext import commands
-from flask import Flask, jsonify
+from aiohttp import web, ClientSession, ClientTimeout
 
 # ---------------- CONFIG ----------------
 TOKEN = os.getenv("TOKEN")
-if not TOKEN:
-    raise RuntimeError("Set TOKEN environment variable with your bot token")
 
 CONFIG_FILE = "config.json"
+# "sqlite" (per-guild rows, WAL) or "json" (single config.json, small installs)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+SQLITE_FILE = os.getenv("SQLITE_FILE", "guardian.db")
+# write-behind: flush dirty guilds every N seconds, or immediately once this many are pending
+CONFIG_FLUSH_INTERVAL = float(os.getenv("CONFIG_FLUSH_INTERVAL", "2"))
+CONFIG_FLUSH_MAX_DIRTY = int(os.getenv("CONFIG_FLUSH_MAX_DIRTY", "50"))
 BOT_LOGO_URL = os.getenv("BOT_LOGO_URL", "https://i.imgur.com/4M34hi2.png")
 EMBED_COLOR = discord.Color.blurple()
+# health + /metrics HTTP server (runs on the bot's event loop)
 KEEP_ALIVE_PORT = int(os.getenv("PORT", os.getenv("KEEP_ALIVE_PORT", "8080")))
+# event-loop lag probe interval, and the lag (seconds) above which /health reports 503 once that (or
+# a closed shard) has lasted HEALTH_DEGRADED_AFTER seconds; / answers 200 whenever the process is up
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "1"))
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "2"))
+HEALTH_DEGRADED_AFTER = float(os.getenv("HEALTH_DEGRADED_AFTER", "30"))
+# /guard_stats latency percentiles cover the last 1-2 windows of this many seconds; guilds tracked (LRU)
+STATS_WINDOW = float(os.getenv("STATS_WINDOW", "300"))
+STATS_MAX_GUILDS = int(os.getenv("STATS_MAX_GUILDS", "1000"))
+# opt-in sampling profiler: stack sample interval in ms (0 = off), distinct frames kept
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "0"))
+PROFILER_MAX_FRAMES = int(os.getenv("PROFILER_MAX_FRAMES", "2000"))
+# client member cache: "all" (the library default with the members intent), "voice" (only members in voice)
+# or "none"; chunking every guild at startup defaults to on only with "all"
+MEMBER_CACHE = os.getenv("MEMBER_CACHE", "all").lower()
+CHUNK_GUILDS_AT_STARTUP = os.getenv("CHUNK_GUILDS_AT_STARTUP", "1" if MEMBER_CACHE == "all" else "0") == "1"
+# client message cache size (0 disables it; automod only reads messages as they arrive)
+MAX_MESSAGES = int(os.getenv("MAX_MESSAGES", "1000"))
+# members fetched on demand when the client cache misses: LRU size and seconds an entry is trusted
+MEMBER_FETCH_CACHE_SIZE = int(os.getenv("MEMBER_FETCH_CACHE_SIZE", "2048"))
+MEMBER_FETCH_TTL = float(os.getenv("MEMBER_FETCH_TTL", "300"))
+# guilds that were not chunked: members the one background admin scan pages through (1000 per request)
+ADMIN_SCAN_MAX_MEMBERS = int(os.getenv("ADMIN_SCAN_MAX_MEMBERS", "10000"))
+# sharding: total shards (0 = Discord's recommendation) and the shards this process runs,
+# e.g. "0-3" or "0,2,5" (empty = all of them); the cluster launcher sets both for each worker
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = os.getenv("SHARD_IDS", "")
+# cluster launcher: worker processes to spread the shards over (0 = run the bot in this process);
+# CLUSTER_ID names a worker in the aggregated health/metrics and is set by the launcher
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "0"))
+CLUSTER_ID = os.getenv("CLUSTER_ID", "")
+# worker i serves its own health/metrics on CLUSTER_BASE_PORT + i; the launcher aggregates on KEEP_ALIVE_PORT
+CLUSTER_BASE_PORT = int(os.getenv("CLUSTER_BASE_PORT", str(KEEP_ALIVE_PORT + 1)))
+# seconds before a worker that exited is restarted, doubled per consecutive crash (max 5 minutes)
+CLUSTER_RESTART_DELAY = float(os.getenv("CLUSTER_RESTART_DELAY", "5"))
+# gateway audit-log attribution: entries kept per guild, max entry age, handler wait budget
+AUDIT_INDEX_SIZE = int(os.getenv("AUDIT_INDEX_SIZE", "256"))
+AUDIT_INDEX_MAX_AGE = float(os.getenv("AUDIT_INDEX_MAX_AGE", "30"))
+AUDIT_WAIT_TIMEOUT = float(os.getenv("AUDIT_WAIT_TIMEOUT", "1.5"))
+# REST fallback: page size of a shared audit-log fetch and how long its result is reused
+AUDIT_FETCH_LIMIT = int(os.getenv("AUDIT_FETCH_LIMIT", "50"))
+AUDIT_CACHE_TTL = float(os.getenv("AUDIT_CACHE_TTL", "3"))
+# in-memory trigger limiter: idle key expiry (seconds) and hard cap on keys per guild
+RATE_LIMIT_KEY_TTL = float(os.getenv("RATE_LIMIT_KEY_TTL", "300"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "1024"))
+# memoized whitelist results kept per guild
+WHITELIST_MEMO_SIZE = int(os.getenv("WHITELIST_MEMO_SIZE", "4096"))
+# concurrent channel permission edits during lockdown/unlock
+LOCKDOWN_CONCURRENCY = int(os.getenv("LOCKDOWN_CONCURRENCY", "8"))
+# log pipeline: queued embeds per guild before overflow, seconds to gather a burst into one message
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "50"))
+LOG_BATCH_DELAY = float(os.getenv("LOG_BATCH_DELAY", "1.0"))
+# control panel edits for a guild are coalesced over this many seconds
+PANEL_REFRESH_DELAY = float(os.getenv("PANEL_REFRESH_DELAY", "1.5"))
+# panel interactions should be acknowledged within this many ms of creation (Discord's hard limit is 3000)
+ACK_BUDGET_MS = float(os.getenv("ACK_BUDGET_MS", "1000"))
+# nuke scoring: sliding window split into buckets, tracked actors per guild
+NUKE_SCORE_WINDOW = float(os.getenv("NUKE_SCORE_WINDOW", "30"))
+NUKE_SCORE_BUCKETS = int(os.getenv("NUKE_SCORE_BUCKETS", "6"))
+NUKE_SCORE_MAX_ACTORS = int(os.getenv("NUKE_SCORE_MAX_ACTORS", "256"))
+# seconds an antinuke incident stays open after its response so concurrent triggers fold into it
+INCIDENT_LINGER = float(os.getenv("INCIDENT_LINGER", "3"))
+# concurrent outgoing REST actions (bans, lockdown edits, logs, panel edits), run in priority order,
+# plus slots only bans/kicks/role strips and lockdown edits may use
+REST_WORKERS = int(os.getenv("REST_WORKERS", "16"))
+REST_RESERVED_WORKERS = int(os.getenv("REST_RESERVED_WORKERS", "16"))
+# join raids: recent joins kept per guild, seconds a raid stays active after the last spike
+RAID_JOIN_BUFFER = int(os.getenv("RAID_JOIN_BUFFER", "1000"))
+RAID_COOLDOWN = float(os.getenv("RAID_COOLDOWN", "60"))
+# raid containment budget per guild: requests/second and concurrent timeouts per round
+RAID_ACTIONS_PER_SEC = float(os.getenv("RAID_ACTIONS_PER_SEC", "5"))
+RAID_ACTION_CONCURRENCY = int(os.getenv("RAID_ACTION_CONCURRENCY", "4"))
+# spam detector: seconds a message fingerprint counts, fingerprints kept per author / per channel,
+# authors and channels tracked per guild (least recently active dropped first)
+SPAM_WINDOW = float(os.getenv("SPAM_WINDOW", "15"))
+SPAM_AUTHOR_RING = int(os.getenv("SPAM_AUTHOR_RING", "8"))
+SPAM_CHANNEL_RING = int(os.getenv("SPAM_CHANNEL_RING", "32"))
+SPAM_MAX_AUTHORS = int(os.getenv("SPAM_MAX_AUTHORS", "2048"))
+SPAM_MAX_CHANNELS = int(os.getenv("SPAM_MAX_CHANNELS", "512"))
+# points per event; an actor is punished once their windowed total reaches the guild's score_threshold
+NUKE_WEIGHTS = {
+    "channels_deleted": 3,
+    "roles_deleted": 3,
+    "bots_added": 3,
+    "member_bans": 2,
+    "member_kicks": 2,
+    "webhooks_created": 2,
+    "channels_created": 1,
+    "roles_created": 1,
+}
 
 # Defaults for a guild
 DEFAULT_GUILD_SETTINGS = {
@@ -56,6 +177,8 @@ DEFAULT_GUILD_SETTINGS = {
         "member_bans": False,
         "member_kicks": False,
         "bots_added": False,
+        "nuke_scoring": False,  # weighted score across all categories per actor
+        "score_threshold": 10,
         "actions": {
             "remove_roles": False,
             "kick_member": False,
@@ -67,51 +190,741 @@ DEFAULT_GUILD_SETTINGS = {
     },
     "automod": {
         "link_invite_filter": False,
+        "link_allow_domains": [],  # normalized domains, subdomains included
+        "link_deny_domains": [],
         "mass_mention_protection": False,
-        "mass_mention_threshold": 5
+        "mass_mention_threshold": 5,
+        "spam_protection": False,
+        "spam_threshold": 4,  # copies of one message from one author within SPAM_WINDOW
+        "spam_channel_threshold": 6  # copies in one channel within SPAM_WINDOW, any authors
+    },
+    "antiraid": {
+        "join_rate_protection": False,
+        "join_threshold": 10,  # joins within join_window seconds that count as a raid
+        "join_window": 10,
+        "min_account_age_days": 7,  # younger accounts joining during a raid are contained
+        "action": "timeout",  # "timeout", "ban" or "none" (alert only)
+        "timeout_minutes": 60
     },
     "whitelist": {
         "antinuke": [],  # list of id strings
         "automod": []
-    },
-    "recent_triggers": {}
+    }
 }
 
+# ---------------- METRICS ----------------
+# default histogram buckets, seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _prom_escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _prom_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_prom_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, *label_values: Any, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: Any) -> float:
+        return self._values.get(label_values, 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for lv, v in self._values.items():
+            out.append(f"{self.name}{_prom_labels(self.labels, lv)} {v:g}")
+        return out
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe is a bisect plus two additions."""
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (last slot is +Inf), sum, count]
+        self._series: Dict[Tuple[Any, ...], List[Any]] = {}
+
+    def observe(self, value: float, *label_values: Any) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for lv, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                out.append(f"{self.name}_bucket{_prom_labels(self.labels, lv, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_prom_labels(self.labels, lv)} {total:g}")
+            out.append(f"{self.name}_count{_prom_labels(self.labels, lv)} {count}")
+        return out
+
+
+class MetricsRegistry:
+    """Process-local Prometheus metrics: counters/histograms updated inline, gauges read at scrape time."""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        # name -> (help, label names, type, callback returning a value or [(label values, value), ...])
+        self._gauges: Dict[str, Tuple[str, Tuple[str, ...], str, Any]] = {}
+
+    def counter(self, name: str, doc: str, labels: Tuple[str, ...] = ()) -> Counter:
+        c = Counter(name, doc, labels)
+        self._metrics.append(c)
+        return c
+
+    def histogram(self, name: str, doc: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        h = Histogram(name, doc, labels, buckets)
+        self._metrics.append(h)
+        return h
+
+    def gauge(self, name: str, doc: str, fn, labels: Tuple[str, ...] = (), kind: str = "gauge") -> None:
+        # kind="counter" for totals that already live elsewhere as plain ints
+        self._gauges[name] = (doc, labels, kind, fn)
+
+    def render(self) -> str:
+        out: List[str] = []
+        for m in self._metrics:
+            out.extend(m.render())
+        for name, (doc, labels, kind, fn) in self._gauges.items():
+            try:
+                samples = fn()
+            except Exception as e:
+                print(f"metrics gauge {name} failed:", e)
+                continue
+            if not isinstance(samples, list):
+                samples = [((), samples)]
+            out.append(f"# HELP {name} {doc}")
+            out.append(f"# TYPE {name} {kind}")
+            for lv, v in samples:
+                if v is not None:
+                    out.append(f"{name}{_prom_labels(labels, lv)} {float(v):g}")
+        return "\n".join(out) + "\n"
+
+
+metrics = MetricsRegistry()
+events_handled = metrics.counter("guardian_events_total", "Gateway events handled", ("event",))
+event_errors = metrics.counter("guardian_event_errors_total", "Gateway event handlers that raised", ("event",))
+audit_fetches = metrics.counter("guardian_audit_fetches_total", "REST audit-log page fetches", ("result",))
+audit_fetch_seconds = metrics.histogram("guardian_audit_fetch_seconds", "REST audit-log page fetch duration")
+punishments = metrics.counter("guardian_punishments_total", "Antinuke triggers by outcome", ("category", "outcome"))
+punishment_seconds = metrics.histogram("guardian_punishment_seconds", "Antinuke response execution time (before linger)")
+rest_requests = metrics.counter("guardian_rest_requests_total", "Scheduled REST actions executed", ("priority",))
+rest_errors = metrics.counter("guardian_rest_errors_total", "Scheduled REST actions that failed", ("priority", "error"))
+rest_wait_seconds = metrics.histogram("guardian_rest_queue_wait_seconds", "Time REST actions wait in the priority queue",
+                                      ("priority",))
+config_save_seconds = metrics.histogram("guardian_config_save_seconds", "Config flush duration")
+config_save_errors = metrics.counter("guardian_config_save_errors_total", "Config flushes that failed")
+loop_lag_seconds = metrics.histogram("guardian_loop_lag_seconds", "Event-loop scheduling lag")
+event_seconds = metrics.histogram("guardian_event_seconds", "Gateway event handler duration", ("event",))
+
+# latency bucket upper bounds in ms: geometric, 0.05 ms .. ~65 s, so percentiles are within 25%
+LATENCY_BOUNDS_MS = tuple(0.05 * 1.25 ** i for i in range(64))
+
+
+class _RollingHistogram:
+    """Fixed-bucket latency histogram over the current and previous ``window``."""
+
+    __slots__ = ("cur", "prev", "started", "total", "max_ms")
+
+    def __init__(self, now: float):
+        self.cur = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+        self.prev = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+        self.started = now
+        self.total = 0
+        self.max_ms = 0.0
+
+    def record(self, ms: float, now: float, window: float) -> None:
+        if now - self.started >= window:
+            if now - self.started >= 2 * window:
+                self.prev = [0] * len(self.cur)
+            else:
+                self.prev = self.cur
+            self.cur = [0] * len(self.prev)
+            self.started = now
+            self.max_ms = 0.0
+        self.cur[bisect.bisect_left(LATENCY_BOUNDS_MS, ms)] += 1
+        self.total += 1
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentiles(self, qs: Tuple[float, ...] = (0.5, 0.95, 0.99)) -> Tuple[int, List[float]]:
+        counts = [a + b for a, b in zip(self.cur, self.prev)]
+        n = sum(counts)
+        out = []
+        for q in qs:
+            rank = q * n
+            seen = 0
+            for i, c in enumerate(counts):
+                seen += c
+                if c and seen >= rank:
+                    out.append(LATENCY_BOUNDS_MS[i] if i < len(LATENCY_BOUNDS_MS) else self.max_ms)
+                    break
+            else:
+                out.append(0.0)
+        return n, out
+
+
+class LatencyStats:
+    """Rolling p50/p95/p99 per timing name, globally and per guild.
+
+    Every histogram is a fixed array of log-scale buckets (current + previous
+    ``window``), so recording is a bisect and an increment and memory is bounded by
+    names x ``max_guilds`` (least recently active guild dropped first).
+    """
+
+    def __init__(self, window: float = STATS_WINDOW, max_guilds: int = STATS_MAX_GUILDS):
+        self.window = window
+        self.max_guilds = max_guilds
+        self._global: Dict[str, _RollingHistogram] = {}
+        self._guilds: "OrderedDict[int, Dict[str, _RollingHistogram]]" = OrderedDict()
+
+    def record(self, name: str, seconds: float, guild_id: Optional[int] = None) -> None:
+        now = time.monotonic()
+        ms = seconds * 1000
+        hist = self._global.get(name)
+        if hist is None:
+            hist = self._global[name] = _RollingHistogram(now)
+        hist.record(ms, now, self.window)
+        if guild_id is None:
+            return
+        per_guild = self._guilds.get(guild_id)
+        if per_guild is None:
+            per_guild = self._guilds[guild_id] = {}
+            if len(self._guilds) > self.max_guilds:
+                self._guilds.popitem(last=False)
+        else:
+            self._guilds.move_to_end(guild_id)
+        hist = per_guild.get(name)
+        if hist is None:
+            hist = per_guild[name] = _RollingHistogram(now)
+        hist.record(ms, now, self.window)
+
+    def summary(self, guild_id: Optional[int] = None, prefix: str = "") -> List[Tuple[str, int, int, List[float]]]:
+        """[(name, total calls, calls in window, [p50, p95, p99] ms)], busiest first."""
+        source = self._global if guild_id is None else self._guilds.get(guild_id, {})
+        rows = []
+        for name, hist in source.items():
+            if name.startswith(prefix):
+                n, pcts = hist.percentiles()
+                rows.append((name[len(prefix):], hist.total, n, pcts))
+        rows.sort(key=lambda r: r[2], reverse=True)
+        return rows
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+
+timings = LatencyStats()
+# perf_counter() at which the gateway event being handled arrived (set by @tracked)
+event_started: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("event_started", default=None)
+
+
+def _event_guild_id(args: Tuple[Any, ...]) -> Optional[int]:
+    if not args:
+        return None
+    first = args[0]
+    guild = first if isinstance(first, discord.Guild) else getattr(first, "guild", None)
+    if guild is not None:
+        return guild.id
+    # raw gateway payloads (e.g. RawMemberRemoveEvent) only carry the id
+    return getattr(first, "guild_id", None)
+
+
+def tracked(handler):
+    # counts and times every call of a gateway event handler (and the ones that raise) by event name
+    event = handler.__name__[3:] if handler.__name__.startswith("on_") else handler.__name__
+    timing_name = f"event:{event}"
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        events_handled.inc(event)
+        t0 = time.perf_counter()
+        token = event_started.set(t0)
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            event_errors.inc(event)
+            raise
+        finally:
+            event_started.reset(token)
+            elapsed = time.perf_counter() - t0
+            event_seconds.observe(elapsed, event)
+            timings.record(timing_name, elapsed, _event_guild_id(args))
+    return wrapper
+
+
+class SamplingProfiler:
+    """Opt-in stack sampler for the event-loop thread (PROFILER_INTERVAL_MS > 0).
+
+    A daemon thread reads the loop thread's current frame every ``interval_ms`` and
+    counts the innermost frame in this file plus the leaf frame, which shows what is
+    holding the loop without instrumenting every call. The sampler needs the GIL, so
+    stretches shorter than the interpreter switch interval are under-sampled. At most
+    ``max_frames`` distinct frames are kept; samples beyond that count as "other".
+    """
+
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, max_frames: int = PROFILER_MAX_FRAMES):
+        self.interval_ms = interval_ms
+        self.max_frames = max_frames
+        self.samples = 0
+        self.idle = 0
+        self._counts: Dict[str, int] = {}
+        # the sampler thread writes _counts while top() reads it on the loop thread
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.interval_ms <= 0 or self.enabled:
+            return
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="guardian-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        interval = self.interval_ms / 1000
+        here = __file__
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            self.samples += 1
+            leaf = frame
+            ours = None
+            while frame is not None:
+                if frame.f_code.co_filename == here:
+                    ours = frame
+                    break
+                frame = frame.f_back
+            if ours is None:
+                self.idle += 1  # selector wait or library code with no bot frame on the stack
+                continue
+            key = f"{ours.f_code.co_name}:{ours.f_lineno}"
+            if leaf is not ours:
+                key += f" > {leaf.f_code.co_name} ({os.path.basename(leaf.f_code.co_filename)})"
+            with self._lock:
+                if key in self._counts or len(self._counts) < self.max_frames:
+                    self._counts[key] = self._counts.get(key, 0) + 1
+                else:
+                    self._counts["other"] = self._counts.get("other", 0) + 1
+
+    def top(self, n: int = 5) -> List[Tuple[str, int]]:
+        with self._lock:
+            counts = list(self._counts.items())
+        return sorted(counts, key=lambda kv: kv[1], reverse=True)[:n]
+
+
+profiler = SamplingProfiler()
+
+
 # ---------------- PERSISTENCE (async safe) ----------------
+class JsonStorage:
+    """Whole-file JSON backend (config.json). Every save rewrites all guilds; fine for small installs."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def load_all(self, owns: Optional[Callable[[int], bool]] = None) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {}
+        async with aiofiles.open(self.path, "r", encoding="utf-8") as f:
+            text = await f.read()
+        db = json.loads(text) if text else {}
+        return db if owns is None else {gid: data for gid, data in db.items() if owns(int(gid))}
+
+    async def save(self, db: Dict[str, Any], guild_ids: Optional[List[str]] = None) -> int:
+        tmp = self.path + ".tmp"
+        text = json.dumps(db, indent=2)
+        async with aiofiles.open(tmp, "w", encoding="utf-8") as f:
+            await f.write(text)
+        os.replace(tmp, self.path)
+        return len(text.encode("utf-8"))
+
+    async def close(self) -> None:
+        return None
+
+
+class SqliteStorage:
+    """SQLite (WAL) backend with one row per guild; saves touch only the changed guilds.
+
+    All blocking sqlite calls run on a dedicated single-thread executor, which also owns
+    the connection. On first load an empty database is seeded from the legacy JSON file.
+    Cluster workers share one database file: each loads (``owns``) and writes only the
+    guilds on its own shards, so their rows never overlap.
+    """
+
+    def __init__(self, path: str, legacy_json: Optional[str] = None):
+        self.path = path
+        self.legacy_json = legacy_json
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="guardian-db")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS guild_settings (guild_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _migrate_json(self, conn: sqlite3.Connection) -> None:
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return
+        if conn.execute("SELECT 1 FROM guild_settings LIMIT 1").fetchone():
+            return
+        with open(self.legacy_json, "r", encoding="utf-8") as f:
+            text = f.read()
+        legacy = json.loads(text) if text else {}
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO guild_settings (guild_id, data) VALUES (?, ?)",
+                [(gid, json.dumps(data, separators=(",", ":"))) for gid, data in legacy.items()],
+            )
+        os.replace(self.legacy_json, self.legacy_json + ".migrated")
+        print(f"Migrated {len(legacy)} guilds from {self.legacy_json} to {self.path}")
+
+    def _load_all_sync(self, owns: Optional[Callable[[int], bool]]) -> Dict[str, Any]:
+        conn = self._connect()
+        self._migrate_json(conn)
+        rows = conn.execute("SELECT guild_id, data FROM guild_settings")
+        # filter before parsing: other workers' guilds are never decoded
+        return {gid: json.loads(data) for gid, data in rows if owns is None or owns(int(gid))}
+
+    def _save_sync(self, rows: List[Tuple[str, str]]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO guild_settings (guild_id, data) VALUES (?, ?) "
+                "ON CONFLICT(guild_id) DO UPDATE SET data = excluded.data",
+                rows,
+            )
+
+    def _close_sync(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def load_all(self, owns: Optional[Callable[[int], bool]] = None) -> Dict[str, Any]:
+        return await self._run(self._load_all_sync, owns)
+
+    async def save(self, db: Dict[str, Any], guild_ids: Optional[List[str]] = None) -> int:
+        ids = list(db) if guild_ids is None else guild_ids
+        # serialize on the loop thread so the executor never sees a dict mid-mutation
+        rows = [(gid, json.dumps(db[gid], separators=(",", ":"))) for gid in ids if gid in db]
+        if rows:
+            await self._run(self._save_sync, rows)
+        return sum(len(data.encode("utf-8")) for _, data in rows)
+
+    async def close(self) -> None:
+        await self._run(self._close_sync)
+        self._executor.shutdown(wait=False)
+
+
+def parse_shard_ids(spec: str) -> Optional[List[int]]:
+    # "0-3,6" -> [0, 1, 2, 3, 6]; empty -> None (every shard)
+    ids = set()
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        lo, _, hi = part.partition("-")
+        ids.update(range(int(lo), int(hi or lo) + 1))
+    return sorted(ids) or None
+
+
+shard_ids = parse_shard_ids(SHARD_IDS)
+if shard_ids is not None and not SHARD_COUNT:
+    raise RuntimeError("SHARD_IDS needs SHARD_COUNT")
+_owned_shards = frozenset(shard_ids) if shard_ids is not None else None
+
+
+def owns_guild(guild_id: int) -> bool:
+    # guilds map to shards by (id >> 22) % shard_count; a process running every shard owns all of them
+    return _owned_shards is None or (guild_id >> 22) % SHARD_COUNT in _owned_shards
+
+
+def make_storage():
+    if STORAGE_BACKEND == "json":
+        if _owned_shards is not None:
+            raise RuntimeError("SHARD_IDS needs STORAGE_BACKEND=sqlite (a JSON save rewrites every guild)")
+        return JsonStorage(CONFIG_FILE)
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_FILE, legacy_json=CONFIG_FILE)
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (expected 'sqlite' or 'json')")
+
+
+storage = make_storage()
 _db_lock = asyncio.Lock()
 _db: Dict[str, Any] = {}
 
 
 async def load_config() -> None:
     global _db
-    if not os.path.exists(CONFIG_FILE):
-        _db = {}
-        return
     async with _db_lock:
         try:
-            async with aiofiles.open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                text = await f.read()
-                _db = json.loads(text) if text else {}
-        except Exception:
+            _db = await storage.load_all(owns_guild if _owned_shards is not None else None)
+        except Exception as e:
+            print("Failed to load config:", e)
             _db = {}
+    _compiled_settings.clear()
+    # drop rate-limit state persisted by older versions (now kept in memory by trigger_limiter)
+    for gid, settings in _db.items():
+        if settings.pop("recent_triggers", None) is not None:
+            persister.mark_dirty(gid)
+
+
+class ConfigPersister:
+    """Write-behind persistence: mutations mark guilds dirty, a background task batches the writes.
+
+    Dirty guilds are flushed every ``interval`` seconds, or sooner once ``max_dirty`` guilds
+    are pending. ``stop()`` performs a final flush and is called on shutdown / SIGTERM.
+    """
+
+    def __init__(self, interval: float = CONFIG_FLUSH_INTERVAL, max_dirty: int = CONFIG_FLUSH_MAX_DIRTY):
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self._dirty: set = set()
+        self._inflight: set = set()
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # metrics
+        self.flushes = 0
+        self.flush_errors = 0
+        self.guilds_written = 0
+        self.bytes_written = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def mark_dirty(self, guild_id: Any) -> None:
+        self._dirty.add(str(guild_id))
+        if len(self._dirty) >= self.max_dirty:
+            self._wake.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="guardian-config-flush")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
 
-
-async def save_config() -> None:
-    async with _db_lock:
-        tmp = CONFIG_FILE + ".tmp"
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        guild_ids = list(self._dirty)
+        self._dirty.clear()
+        self._inflight.update(guild_ids)
+        t0 = time.perf_counter()
+        async with _db_lock:
+            try:
+                written = await storage.save(_db, guild_ids)
+            except Exception as e:
+                # keep them dirty so the next flush retries
+                self._dirty.update(guild_ids)
+                self.flush_errors += 1
+                config_save_errors.inc()
+                print("Failed to flush config:", e)
+                return
+            finally:
+                self._inflight.difference_update(guild_ids)
+        for gid in guild_ids:
+            if gid not in self._dirty:
+                for fut in self._waiters.pop(gid, ()):
+                    if not fut.done():
+                        fut.set_result(True)
+        elapsed = (time.perf_counter() - t0) * 1000
+        config_save_seconds.observe(elapsed / 1000)
+        self.flushes += 1
+        self.guilds_written += len(guild_ids)
+        self.bytes_written += written or 0
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        self.total_flush_ms += elapsed
+
+    async def wait_flushed(self, guild_id: Any, timeout: float = 10.0) -> bool:
+        """Wait until the guild's pending changes are written; False on timeout."""
+        sid = str(guild_id)
+        if sid not in self._dirty and sid not in self._inflight:
+            return True
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(sid, []).append(fut)
         try:
-            async with aiofiles.open(tmp, "w", encoding="utf-8") as f:
-                await f.write(json.dumps(_db, indent=2))
-            os.replace(tmp, CONFIG_FILE)
-        except Exception as e:
-            print("Failed to save config:", e)
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self._waiters.get(sid)
+            if waiters and fut in waiters:
+                waiters.remove(fut)
+                if not waiters:
+                    del self._waiters[sid]
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._dirty),
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "guilds_written": self.guilds_written,
+            "bytes_written": self.bytes_written,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+persister = ConfigPersister()
+
+
+_settings_versions: Dict[str, int] = {}
+# guild_id -> GuildSettings, dropped whenever the guild's settings change
+_compiled_settings: Dict[int, "GuildSettings"] = {}
+
+
+def touch_settings(guild_id: Any) -> None:
+    # call after mutating a guild's settings: bumps its version (render caches key on it),
+    # drops its compiled settings and schedules a write
+    sid = str(guild_id)
+    _settings_versions[sid] = _settings_versions.get(sid, 0) + 1
+    _compiled_settings.pop(int(sid), None)
+    persister.mark_dirty(sid)
+
+
+def settings_version(guild_id: Any) -> int:
+    return _settings_versions.get(str(guild_id), 0)
+
+
+async def save_config(guild_id: Optional[Any] = None) -> None:
+    # immediate write (bypasses the flush interval); None saves every guild
+    for gid in (_db if guild_id is None else [guild_id]):
+        persister.mark_dirty(gid)
+    await persister.flush()
+
+
+def _copy_settings(value: Any) -> Any:
+    # structural copy of the defaults (dicts, lists, scalars) without a JSON round-trip
+    if isinstance(value, dict):
+        return {k: _copy_settings(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_settings(v) for v in value]
+    return value
 
 
 def ensure_guild_data(guild_id: int) -> None:
+    # only write paths need a stored entry; event handlers read guild_settings() instead
     sid = str(guild_id)
     if sid not in _db:
-        # deep copy default
-        _db[sid] = json.loads(json.dumps(DEFAULT_GUILD_SETTINGS))
+        _db[sid] = _copy_settings(DEFAULT_GUILD_SETTINGS)
+
+
+_ANTINUKE_CATEGORIES = ("channels_deleted", "channels_created", "roles_deleted", "roles_created",
+                        "webhooks_created", "member_bans", "member_kicks", "bots_added")
+
+
+class GuildSettings:
+    """Read-only snapshot of a guild's stored settings, flattened for hot-path checks.
+
+    Built from the stored dict (missing keys fall back to DEFAULT_GUILD_SETTINGS without
+    copying anything) and cached per guild by ``guild_settings`` until
+    ``touch_settings`` reports a change. Toggles become plain attributes; enabled antinuke
+    categories and response actions become frozensets, so a handler's check is a
+    single attribute read or membership test.
+    """
+
+    __slots__ = ("version", "guard_enabled", "log_channel_id", "antinuke", "nuke_scoring", "score_threshold",
+                 "actions", "link_filter", "mass_mention", "mass_mention_threshold", "spam", "spam_threshold",
+                 "spam_channel_threshold", "join_rate", "join_threshold", "join_window", "min_account_age",
+                 "raid_action", "timeout_minutes")
+
+    def __init__(self, raw: Dict[str, Any], version: int = 0):
+        d = DEFAULT_GUILD_SETTINGS
+        ant = raw.get("antinuke", {})
+        acts = ant.get("actions", {})
+        am = raw.get("automod", {})
+        ar = raw.get("antiraid", {})
+        self.version = version
+        self.guard_enabled = bool(raw.get("guard_enabled", d["guard_enabled"]))
+        self.log_channel_id = raw.get("log_channel_id")
+        self.antinuke = frozenset(k for k in _ANTINUKE_CATEGORIES if ant.get(k, d["antinuke"][k]))
+        self.nuke_scoring = bool(ant.get("nuke_scoring", d["antinuke"]["nuke_scoring"]))
+        self.score_threshold = int(ant.get("score_threshold", d["antinuke"]["score_threshold"]))
+        self.actions = frozenset(k for k, v in d["antinuke"]["actions"].items() if acts.get(k, v))
+        self.link_filter = bool(am.get("link_invite_filter", d["automod"]["link_invite_filter"]))
+        self.mass_mention = bool(am.get("mass_mention_protection", d["automod"]["mass_mention_protection"]))
+        self.mass_mention_threshold = int(am.get("mass_mention_threshold", d["automod"]["mass_mention_threshold"]))
+        self.spam = bool(am.get("spam_protection", d["automod"]["spam_protection"]))
+        self.spam_threshold = int(am.get("spam_threshold", d["automod"]["spam_threshold"]))
+        self.spam_channel_threshold = int(am.get("spam_channel_threshold", d["automod"]["spam_channel_threshold"]))
+        self.join_rate = bool(ar.get("join_rate_protection", d["antiraid"]["join_rate_protection"]))
+        self.join_threshold = int(ar.get("join_threshold", d["antiraid"]["join_threshold"]))
+        self.join_window = float(ar.get("join_window", d["antiraid"]["join_window"]))
+        self.min_account_age = float(ar.get("min_account_age_days", d["antiraid"]["min_account_age_days"])) * 86400
+        self.raid_action = str(ar.get("action", d["antiraid"]["action"]))
+        self.timeout_minutes = int(ar.get("timeout_minutes", d["antiraid"]["timeout_minutes"]))
+
+
+def guild_settings(guild_id: int) -> GuildSettings:
+    # guilds with nothing stored compile from the defaults; no entry is created for them
+    cs = _compiled_settings.get(guild_id)
+    if cs is None:
+        sid = str(guild_id)
+        cs = _compiled_settings[guild_id] = GuildSettings(_db.get(sid, {}), settings_version(sid))
+    return cs
+
+
+def forget_guild_settings(guild_id: int) -> None:
+    _compiled_settings.pop(guild_id, None)
 
 
 # ---------------- BOT INIT ----------------
@@ -120,7 +933,31 @@ intents.guilds = True
 intents.members = True
 intents.messages = True
 intents.message_content = True  # required for automod scanning
-bot = commands.Bot(command_prefix="!", intents=intents)
+intents.moderation = True  # required for on_audit_log_entry_create
+
+
+def member_cache_flags(mode: str) -> discord.MemberCacheFlags:
+    if mode == "all":
+        return discord.MemberCacheFlags.from_intents(intents)
+    if mode == "voice":
+        return discord.MemberCacheFlags(joined=False)
+    if mode == "none":
+        return discord.MemberCacheFlags.none()
+    raise RuntimeError(f"Unknown MEMBER_CACHE {mode!r} (expected 'all', 'voice' or 'none')")
+
+
+member_cache = member_cache_flags(MEMBER_CACHE)
+# one process, many shards: every shard's events share this loop (see run_cluster for several processes)
+bot = commands.AutoShardedBot(
+    command_prefix="!",
+    intents=intents,
+    shard_count=SHARD_COUNT or None,
+    shard_ids=shard_ids,
+    member_cache_flags=member_cache,
+    # chunking fills only the "joined" part of the cache, so it is pointless without it
+    chunk_guilds_at_startup=CHUNK_GUILDS_AT_STARTUP and member_cache.joined,
+    max_messages=MAX_MESSAGES or None,
+)
 tree = bot.tree
 
 
@@ -133,74 +970,868 @@ def bool_mark(v: bool) -> str:
     return "✅" if v else "❌"
 
 
-async def send_log_embed(guild: discord.Guild, embed: discord.Embed, settings: Dict[str, Any]) -> None:
+class TaskTracker:
+    """Strong references to fire-and-forget tasks; failures are counted and printed."""
+
+    def __init__(self):
+        self._tasks: set = set()
+        self.failed = 0
+
+    def spawn(self, coro, name: Optional[str] = None) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            print(f"Background task {task.get_name()} failed:", task.exception())
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def drain(self, timeout: float = 5.0) -> None:
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+
+
+background = TaskTracker()
+
+
+class AckStats:
+    """Interaction acknowledgement latency (interaction creation -> ack sent) against a budget."""
+
+    def __init__(self, budget_ms: float = ACK_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.count = 0
+        self.over_budget = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms: float) -> None:
+        self.count += 1
+        self.last_ms = ms
+        self.max_ms = max(self.max_ms, ms)
+        if ms > self.budget_ms:
+            self.over_budget += 1
+            print(f"Interaction ack took {ms:.0f} ms (budget {self.budget_ms:.0f} ms)")
+
+
+ack_stats = AckStats()
+
+
+class RestPriority(enum.IntEnum):
+    CONTAINMENT = 0  # ban / kick / strip roles
+    LOCKDOWN = 1  # channel overwrite edits
+    LOGGING = 2  # log channel posts, admin DMs
+    COSMETIC = 3  # control panel edits
+
+
+class RestScheduler:
+    """Priority-ordered admission for the bot's outgoing REST actions.
+
+    A call runs in the caller's task once it holds a slot. ``workers`` shared slots
+    serve every priority, lowest priority value first (FIFO within a priority);
+    ``reserved`` more only ever serve CONTAINMENT and LOCKDOWN. Log posts and panel
+    edits can occupy at most the shared slots (e.g. all of them sleeping through a
+    429), so bans, kicks and lockdown edits always have slots of their own. Only leaf
+    REST calls go through here; a call holding a slot must not await the scheduler
+    itself. Results and exceptions propagate to the caller unchanged.
+    """
+
+    # this priority and the ones before it may also use the reserved slots
+    URGENT = RestPriority.LOCKDOWN
+
+    def __init__(self, workers: int = REST_WORKERS, reserved: int = REST_RESERVED_WORKERS):
+        self.workers = workers
+        self.reserved = reserved
+        self._busy = 0
+        self._busy_reserved = 0
+        # heap of (priority, seq, future); the future resolves to the slot handed over
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._stats = {p: {"depth": 0, "submitted": 0, "failed": 0, "wait_total": 0.0, "wait_max": 0.0}
+                       for p in RestPriority}
+
+    def _free_slot(self, prio: int) -> Optional[bool]:
+        # True: a reserved slot, False: a shared one, None: nothing free for this priority
+        if prio <= self.URGENT and self._busy_reserved < self.reserved:
+            return True
+        if self._busy < self.workers:
+            return False
+        return None
+
+    def _take(self, reserved: bool) -> None:
+        if reserved:
+            self._busy_reserved += 1
+        else:
+            self._busy += 1
+
+    def _release(self, reserved: bool) -> None:
+        if reserved:
+            self._busy_reserved -= 1
+        else:
+            self._busy -= 1
+        # the heap head has the lowest priority value: if it cannot run, nothing behind it can either
+        while self._waiters:
+            prio, _, fut = self._waiters[0]
+            if fut.done():  # caller gave up while queued
+                heapq.heappop(self._waiters)
+                continue
+            slot = self._free_slot(prio)
+            if slot is None:
+                return
+            heapq.heappop(self._waiters)
+            self._take(slot)
+            fut.set_result(slot)
+
+    async def _acquire(self, prio: int) -> bool:
+        if not self._waiters or self._waiters[0][0] > prio:
+            slot = self._free_slot(prio)
+            if slot is not None:
+                self._take(slot)
+                return slot
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (prio, next(self._seq), fut))
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():  # cancelled right after being handed a slot
+                self._release(fut.result())
+            raise
+
+    async def run(self, priority: RestPriority, fn, *args, **kwargs):
+        stats = self._stats[priority]
+        stats["depth"] += 1
+        stats["submitted"] += 1
+        queued = time.monotonic()
+        try:
+            slot = await self._acquire(int(priority))
+        finally:
+            stats["depth"] -= 1
+        wait = time.monotonic() - queued
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        name = priority.name.lower()
+        rest_wait_seconds.observe(wait, name)
+        timings.record(f"rest_wait:{name}", wait)
+        rest_requests.inc(name)
+        t0 = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            stats["failed"] += 1
+            rest_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            timings.record(f"rest:{name}", time.perf_counter() - t0)
+            self._release(slot)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for p, st in self._stats.items():
+            started = st["submitted"] - st["depth"]
+            out[p.name.lower()] = {
+                "depth": st["depth"],
+                "submitted": st["submitted"],
+                "failed": st["failed"],
+                "avg_wait_ms": round(st["wait_total"] / started * 1000, 3) if started else 0.0,
+                "max_wait_ms": round(st["wait_max"] * 1000, 3),
+            }
+        return out
+
+    async def close(self) -> None:
+        # calls still queued at shutdown are cancelled; calls holding a slot finish in their own tasks
+        for _, _, fut in self._waiters:
+            fut.cancel()
+        self._waiters = []
+
+
+rest = RestScheduler()
+
+
+async def deliver_log_embeds(guild: discord.Guild, embeds: List[discord.Embed], settings: Dict[str, Any]) -> bool:
+    """Send to the log channel, falling back to DMs; False when nobody received the embeds."""
     cid = settings.get("log_channel_id")
     if cid:
         ch = guild.get_channel(cid)
         if ch and ch.permissions_for(guild.me).send_messages:
             try:
-                await ch.send(embed=embed)
-                return
+                await rest.run(RestPriority.LOGGING, ch.send, embeds=embeds)
+                return True
             except Exception:
                 pass
-    # fallback: DM owner and up to 2 admins
-    owner = guild.owner
-    if owner:
+    # fallback: DM owner and up to 2 admins, concurrently
+    return await notify_admins_dm(guild, embeds) > 0
+
+
+async def _try_dm(member: discord.abc.User, embeds: List[discord.Embed]) -> bool:
+    try:
+        await rest.run(RestPriority.LOGGING, member.send, embeds=embeds)
+        return True
+    except Exception:
+        return False
+
+
+async def notify_admins_dm(guild: discord.Guild, embeds: List[discord.Embed], limit: int = 2) -> int:
+    owner = await member_resolver.resolve(guild, guild.owner_id, RestPriority.LOGGING) if guild.owner_id else None
+    pending = [mid for mid in admin_index.candidates(guild) if mid != guild.owner_id]
+    sends = [_try_dm(owner, embeds)] if owner else []
+    sent = delivered = 0
+    # first round goes out together with the owner DM; refill from the rest only on failures
+    while pending and sent < limit:
+        batch = await admin_index.take(guild, pending, limit - sent)
+        results = await asyncio.gather(*sends, *(_try_dm(m, embeds) for m in batch))
+        sent += sum(results[len(sends):])
+        delivered += sum(results)
+        sends = []
+    if sends:
+        delivered += sum(await asyncio.gather(*sends))
+    return delivered
+
+
+class MemberResolver:
+    """Members outside the client cache, fetched on demand and kept in a small LRU.
+
+    With ``MEMBER_CACHE`` below "all" (or startup chunking off) the client only holds
+    members it has seen since connecting. Paths that need a full ``discord.Member``
+    (whitelist checks, punishments, admin DMs) look here: client cache, then the LRU,
+    then one single-flight ``fetch_member`` per (guild, member). Members that are gone
+    are cached as ``None`` too; every entry expires after ``ttl`` seconds since member
+    updates are only delivered for cached members.
+    """
+
+    def __init__(self, size: int = MEMBER_FETCH_CACHE_SIZE, ttl: float = MEMBER_FETCH_TTL):
+        self.size = size
+        self.ttl = ttl
+        # (guild_id, member_id) -> (expires_at, member or None)
+        self._lru: "OrderedDict[Tuple[int, int], Tuple[float, Optional[discord.Member]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, int], asyncio.Task] = {}
+        # metrics
+        self.hits = 0
+        self.fetches = 0
+
+    def _lookup(self, key: Tuple[int, int]) -> Tuple[bool, Optional[discord.Member]]:
+        item = self._lru.get(key)
+        if item is None:
+            return False, None
+        if item[0] <= time.monotonic():
+            del self._lru[key]
+            return False, None
+        self._lru.move_to_end(key)
+        self.hits += 1
+        return True, item[1]
+
+    def _store(self, key: Tuple[int, int], member: Optional[discord.Member]) -> None:
+        self._lru[key] = (time.monotonic() + self.ttl, member)
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.size:
+            self._lru.popitem(last=False)
+
+    def get(self, guild: discord.Guild, member_id: int) -> Optional[discord.Member]:
+        """Cached member only; never makes a request."""
+        member = guild.get_member(member_id)
+        if member is None:
+            member = self._lookup((guild.id, member_id))[1]
+        return member
+
+    def remember(self, member: discord.Member) -> None:
+        """Keep a member the client cache will not (e.g. a joiner with MEMBER_CACHE=none)."""
+        self._store((member.guild.id, member.id), member)
+        whitelist_index.invalidate_member(member.guild.id, member.id)
+
+    async def _fetch(self, guild: discord.Guild, member_id: int, priority: "RestPriority") -> Optional[discord.Member]:
+        self.fetches += 1
         try:
-            await owner.send(embed=embed)
-        except Exception:
-            pass
-    sent = 0
-    for m in guild.members:
-        if sent >= 2:
-            break
-        if m.guild_permissions.administrator and not m.bot and m != owner:
+            member = await rest.run(priority, guild.fetch_member, member_id)
+        except discord.NotFound:
+            member = None
+        self._store((guild.id, member_id), member)
+        if member is not None:
+            whitelist_index.invalidate_member(guild.id, member_id)
+        return member
+
+    def _release(self, key: Tuple[int, int], task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved; callers re-raise through await
+
+    async def resolve(self, guild: discord.Guild, member_id: int,
+                      priority: "RestPriority" = RestPriority.CONTAINMENT) -> Optional[discord.Member]:
+        member = guild.get_member(member_id)
+        if member is not None:
+            return member
+        key = (guild.id, member_id)
+        found, member = self._lookup(key)
+        if found:
+            return member
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(guild, member_id, priority))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._release(key, t))
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            print("member fetch failed:", e)
+            return None
+
+    def known_missing(self, guild_id: int, member_id: int) -> bool:
+        """True when a fetch confirmed the member is gone (404), not when it merely failed."""
+        item = self._lru.get((guild_id, member_id))
+        return item is not None and item[1] is None
+
+    def forget(self, guild_id: int, member_id: int) -> None:
+        self._lru.pop((guild_id, member_id), None)
+
+    def forget_guild(self, guild_id: int) -> None:
+        for key in [k for k in self._lru if k[0] == guild_id]:
+            del self._lru[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._lru), "hits": self.hits, "fetches": self.fetches, "inflight": len(self._inflight)}
+
+
+member_resolver = MemberResolver()
+
+
+class AdminIndex:
+    """Per-guild set of notifiable administrators (non-bot members with Administrator).
+
+    Built lazily from the client cache, then maintained incrementally from member
+    updates/removals; role permission changes mark the guild for a rebuild. A guild
+    that was not chunked and has a role granting Administrator also gets one
+    background member scan (at most ``scan_limit`` members, COSMETIC priority), so
+    the DM fallback never pages the member list while delivering logs.
+    """
+
+    def __init__(self, scan_limit: int = ADMIN_SCAN_MAX_MEMBERS):
+        self.scan_limit = scan_limit
+        self._admins: Dict[int, set] = {}
+        self._scans: Dict[int, asyncio.Task] = {}
+
+    def _build(self, guild: discord.Guild) -> set:
+        ids = {m.id for m in guild.members if not m.bot and m.guild_permissions.administrator}
+        self._admins[guild.id] = ids
+        # Administrator only comes from roles (or ownership, DMed separately): no such role, nothing to find
+        if not guild.chunked and guild.id not in self._scans and any(r.permissions.administrator for r in guild.roles):
+            self._scans[guild.id] = background.spawn(self._scan(guild, ids), name=f"guardian-admin-scan-{guild.id}")
+        return ids
+
+    async def _scan_members(self, guild: discord.Guild) -> set:
+        found = set()
+        async for m in guild.fetch_members(limit=self.scan_limit):
+            if not m.bot and m.guild_permissions.administrator:
+                found.add(m.id)
+                member_resolver.remember(m)
+        return found
+
+    async def _scan(self, guild: discord.Guild, ids: set) -> None:
+        try:
+            found = await rest.run(RestPriority.COSMETIC, self._scan_members, guild)
+        except Exception as e:
+            print("admin scan failed:", e)
+            if self._admins.get(guild.id) is ids:
+                del self._admins[guild.id]  # rebuild (and scan again) on the next delivery
+            return
+        finally:
+            if self._scans.get(guild.id) is asyncio.current_task():
+                del self._scans[guild.id]
+        ids.update(found)
+
+    def candidates(self, guild: discord.Guild) -> List[int]:
+        ids = self._admins.get(guild.id)
+        if ids is None:
+            ids = self._build(guild)
+        # cached members first: DMing them costs no member fetch
+        return sorted(ids, key=lambda mid: member_resolver.get(guild, mid) is None)
+
+    async def take(self, guild: discord.Guild, pending: List[int], count: int) -> List[discord.Member]:
+        """Resolve admins from the front of ``pending`` (consumed) until ``count`` are found or it runs out."""
+        ids = self._admins.get(guild.id)
+        members: List[discord.Member] = []
+        while pending and len(members) < count:
+            chunk = pending[:count - len(members)]
+            del pending[:len(chunk)]
+            found = await asyncio.gather(*(member_resolver.resolve(guild, mid, RestPriority.LOGGING) for mid in chunk))
+            for mid, m in zip(chunk, found):
+                if m is not None:
+                    members.append(m)
+                elif ids is not None and member_resolver.known_missing(guild.id, mid):
+                    ids.discard(mid)  # a failed fetch (5xx, timeout) keeps the admin for next time
+        return members
+
+    def update_member(self, member: discord.Member) -> None:
+        ids = self._admins.get(member.guild.id)
+        if ids is None:
+            return
+        if not member.bot and member.guild_permissions.administrator:
+            ids.add(member.id)
+        else:
+            ids.discard(member.id)
+
+    def remove_member(self, guild_id: int, member_id: int) -> None:
+        ids = self._admins.get(guild_id)
+        if ids is not None:
+            ids.discard(member_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        self._admins.pop(guild_id, None)
+        scan = self._scans.pop(guild_id, None)
+        if scan is not None:
+            scan.cancel()
+
+
+admin_index = AdminIndex()
+
+
+class LogPipeline:
+    """Per-guild log queues drained by background workers, off the detection path.
+
+    ``submit`` only appends to a bounded deque. A worker (started on demand, exits when
+    its queue is empty) waits ``batch_delay`` for a burst to accumulate, then packs up
+    to 10 embeds (within Discord's 6000-character total) into one message. Embeds that
+    arrive while the queue is full are dropped and summarized in the next message.
+    """
+
+    MAX_EMBEDS = 10
+    MAX_CHARS = 6000
+
+    def __init__(self, max_queue: int = LOG_QUEUE_SIZE, batch_delay: float = LOG_BATCH_DELAY):
+        self.max_queue = max_queue
+        self.batch_delay = batch_delay
+        self._queues: Dict[int, deque] = {}
+        self._guilds: Dict[int, discord.Guild] = {}
+        self._pending_drops: Dict[int, int] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.messages_sent = 0
+        self.embeds_sent = 0
+        self.send_errors = 0
+
+    def submit(self, guild: discord.Guild, embed: discord.Embed) -> None:
+        q = self._queues.get(guild.id)
+        if q is None:
+            q = self._queues[guild.id] = deque()
+        self._guilds[guild.id] = guild
+        if len(q) >= self.max_queue:
+            self.dropped += 1
+            self._pending_drops[guild.id] = self._pending_drops.get(guild.id, 0) + 1
+        else:
+            q.append(embed)
+            self.enqueued += 1
+        worker = self._workers.get(guild.id)
+        if worker is None or worker.done():
+            self._workers[guild.id] = asyncio.create_task(self._drain(guild.id), name=f"guardian-log-{guild.id}")
+
+    def _next_batch(self, guild_id: int) -> List[discord.Embed]:
+        q = self._queues.get(guild_id) or deque()
+        dropped = self._pending_drops.pop(guild_id, 0)
+        limit = self.MAX_EMBEDS - (1 if dropped else 0)
+        batch: List[discord.Embed] = []
+        chars = 0
+        while q and len(batch) < limit and (not batch or chars + len(q[0]) <= self.MAX_CHARS - 100):
+            embed = q.popleft()
+            chars += len(embed)
+            batch.append(embed)
+        if dropped:
+            batch.append(discord.Embed(
+                title="Guardian — Log overflow",
+                description=f"+{dropped} more events not shown (log queue full).",
+                color=discord.Color.dark_grey(),
+                timestamp=utc_now(),
+            ))
+        return batch
+
+    async def _drain(self, guild_id: int) -> None:
+        try:
+            while self._queues.get(guild_id) or self._pending_drops.get(guild_id):
+                if len(self._queues.get(guild_id) or ()) < self.MAX_EMBEDS:
+                    await asyncio.sleep(self.batch_delay)  # let a burst accumulate
+                guild = self._guilds.get(guild_id)
+                batch = self._next_batch(guild_id)
+                settings = _db.get(str(guild_id))
+                if not batch:
+                    continue
+                if guild is None or settings is None:
+                    self.dropped += len(batch)  # guild left or its settings were removed meanwhile
+                    continue
+                try:
+                    t0 = time.perf_counter()
+                    delivered = await deliver_log_embeds(guild, batch, settings)
+                    timings.record("stage:log_delivery", time.perf_counter() - t0, guild_id)
+                except Exception:
+                    delivered = False
+                if delivered:
+                    self.messages_sent += 1
+                    self.embeds_sent += len(batch)
+                else:
+                    self.send_errors += 1  # neither the log channel nor any DM took the batch
+        finally:
+            self._workers.pop(guild_id, None)
+            if not self._queues.get(guild_id):
+                self._queues.pop(guild_id, None)
+                self._guilds.pop(guild_id, None)
+
+    def queue_depth(self, guild_id: Optional[int] = None) -> int:
+        if guild_id is not None:
+            return len(self._queues.get(guild_id) or ())
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth(),
+            "active_guilds": len(self._workers),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "messages_sent": self.messages_sent,
+            "embeds_sent": self.embeds_sent,
+            "send_errors": self.send_errors,
+        }
+
+
+log_pipeline = LogPipeline()
+
+
+def send_log_embed(guild: discord.Guild, embed: discord.Embed) -> None:
+    # never blocks: delivery (batched) happens in the guild's log worker
+    log_pipeline.submit(guild, embed)
+
+
+class WhitelistIndex:
+    """Compiled per-guild whitelists plus a memo of per-member results.
+
+    Stored entries (string ids of users or roles) are compiled into separate integer
+    sets on first use and only recompiled after ``invalidate_guild`` (whitelist edits,
+    role changes). Results per (member, category) are memoized until the member or
+    one of the guild's roles is updated.
+    """
+
+    def __init__(self, memo_size: int = WHITELIST_MEMO_SIZE):
+        self.memo_size = memo_size
+        # guild_id -> category -> (user ids, role ids)
+        self._compiled: Dict[int, Dict[str, Tuple[frozenset, frozenset]]] = {}
+        # guild_id -> (member_id, category) -> result
+        self._memo: Dict[int, Dict[Tuple[int, str], bool]] = {}
+
+    def _compile(self, guild: discord.Guild, settings: Dict[str, Any], category: str) -> Tuple[frozenset, frozenset]:
+        users, roles = set(), set()
+        for raw in settings.get("whitelist", {}).get(category, []):
             try:
-                await m.send(embed=embed)
-                sent += 1
-            except Exception:
+                eid = int(raw)
+            except (TypeError, ValueError):
                 continue
+            (roles if guild.get_role(eid) is not None else users).add(eid)
+        compiled = (frozenset(users), frozenset(roles))
+        self._compiled.setdefault(guild.id, {})[category] = compiled
+        return compiled
+
+    def check(self, settings: Dict[str, Any], category: str, member: discord.Member) -> bool:
+        guild = member.guild
+        memo = self._memo.get(guild.id)
+        if memo is None:
+            memo = self._memo[guild.id] = {}
+        key = (member.id, category)
+        hit = memo.get(key)
+        if hit is not None:
+            return hit
+        # implicit whitelist for owner and admins
+        if member.id == guild.owner_id or member.guild_permissions.administrator:
+            result = True
+        else:
+            compiled = self._compiled.get(guild.id, {}).get(category)
+            if compiled is None:
+                compiled = self._compile(guild, settings, category)
+            users, roles = compiled
+            result = member.id in users or (bool(roles) and not roles.isdisjoint(r.id for r in member.roles))
+        # member updates only arrive for cached members, so only their results can be kept
+        if guild.chunked or guild.get_member(member.id) is not None:
+            if len(memo) >= self.memo_size:
+                del memo[next(iter(memo))]
+            memo[key] = result
+        return result
+
+    def invalidate_member(self, guild_id: int, member_id: int) -> None:
+        memo = self._memo.get(guild_id)
+        if memo:
+            memo.pop((member_id, "antinuke"), None)
+            memo.pop((member_id, "automod"), None)
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        self._compiled.pop(guild_id, None)
+        self._memo.pop(guild_id, None)
+
+
+whitelist_index = WhitelistIndex()
 
 
 def is_whitelisted(settings: Dict[str, Any], category: str, member: discord.Member) -> bool:
-    # implicit whitelist for owner and admins
-    if member == member.guild.owner or member.guild_permissions.administrator:
-        return True
-    wl = settings.get("whitelist", {}).get(category, [])
-    if not wl:
-        return False
-    s = str(member.id)
-    if s in wl:
-        return True
-    for r in member.roles:
-        if str(r.id) in wl:
+    return whitelist_index.check(settings, category, member)
+
+
+class SlidingWindowLimiter:
+    """In-memory per-guild trigger limiter; nothing here is persisted.
+
+    Each ``key`` owns a ring (deque, maxlen=limit) of its last allowed timestamps, so a
+    check is O(1): allowed if the ring has room or its oldest stamp left the window.
+    Keys idle for ``ttl`` seconds are evicted and each guild holds at most
+    ``max_keys_per_guild`` keys (least recently used dropped first).
+    """
+
+    def __init__(self, ttl: float = RATE_LIMIT_KEY_TTL, max_keys_per_guild: int = RATE_LIMIT_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys_per_guild = max_keys_per_guild
+        # guild_id -> OrderedDict[key, (ring, last_seen)], ordered by last use
+        self._guilds: Dict[int, "OrderedDict[str, Tuple[deque, float]]"] = {}
+
+    def allows(self, guild_id: int, key: str, window_seconds: float = 10, limit: int = 3) -> bool:
+        now = time.monotonic()
+        keys = self._guilds.get(guild_id)
+        if keys is None:
+            keys = self._guilds[guild_id] = OrderedDict()
+        item = keys.get(key)
+        if item is None or item[0].maxlen != limit:
+            ring = deque(maxlen=limit)
+        else:
+            ring = item[0]
+        keys[key] = (ring, now)
+        keys.move_to_end(key)
+        self._evict(keys, now)
+        if len(ring) < limit or now - ring[0] >= window_seconds:
+            ring.append(now)
             return True
-    return False
+        return False
+
+    def _evict(self, keys: "OrderedDict[str, Tuple[deque, float]]", now: float) -> None:
+        while len(keys) > self.max_keys_per_guild:
+            keys.popitem(last=False)
+        while keys:
+            oldest_key = next(iter(keys))
+            if now - keys[oldest_key][1] < self.ttl:
+                break
+            del keys[oldest_key]
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+
+trigger_limiter = SlidingWindowLimiter()
+# spam notices key on every flooding author; separate, so a spam wave cannot evict antinuke trigger state
+spam_notice_limiter = SlidingWindowLimiter()
+
+
+def rate_limit_allows(guild_id: int, key: str, window_seconds: int = 10, limit: int = 3) -> bool:
+    return trigger_limiter.allows(guild_id, key, window_seconds=window_seconds, limit=limit)
+
+
+class AuditFetchCoalescer:
+    """Single-flight REST audit-log reader shared by concurrent handlers.
+
+    At most one ``guild.audit_logs`` request per ``(guild, action)`` is in flight;
+    every caller arriving meanwhile awaits the same task. The fetched page is cached
+    for ``ttl`` seconds so later handlers in the same burst are served from memory;
+    expired pages are evicted (oldest first) whenever the cache is read or written.
+    """
+
+    def __init__(self, page_size: int = AUDIT_FETCH_LIMIT, ttl: float = AUDIT_CACHE_TTL):
+        self.page_size = page_size
+        self.ttl = ttl
+        # (guild_id, action) -> (started_at, task)
+        self._inflight: Dict[Tuple[int, Any], Tuple[float, asyncio.Task]] = {}
+        # (guild_id, action) -> (started_at, entries), oldest fetch first
+        self._cache: "OrderedDict[Tuple[int, Any], Tuple[float, List[discord.AuditLogEntry]]]" = OrderedDict()
+        self.requests = 0
+        self.shared = 0
 
+    async def _fetch(self, guild: discord.Guild, action: discord.AuditLogAction, key: Tuple[int, Any], started: float):
+        self.requests += 1
+        t0 = time.perf_counter()
+        try:
+            entries = [entry async for entry in guild.audit_logs(limit=self.page_size, action=action)]
+        except Exception:
+            audit_fetches.inc("error")
+            raise
+        finally:
+            audit_fetch_seconds.observe(time.perf_counter() - t0)
+        audit_fetches.inc("ok")
+        cached = self._cache.get(key)
+        if not cached or cached[0] <= started:
+            self._cache[key] = (started, entries)
+            self._cache.move_to_end(key)
+        self._expire(time.monotonic())
+        return entries
+
+    def _expire(self, now: float) -> None:
+        while self._cache:
+            key, (started, _) = next(iter(self._cache.items()))
+            if now - started < self.ttl:
+                break
+            del self._cache[key]
+
+    def _release(self, key: Tuple[int, Any], task: asyncio.Task) -> None:
+        cur = self._inflight.get(key)
+        if cur and cur[1] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved; callers re-raise through await
+
+    async def entries(self, guild: discord.Guild, action: discord.AuditLogAction,
+                      newer_than: Optional[float] = None) -> List[discord.AuditLogEntry]:
+        """Return a recent page of entries, fetched no earlier than ``newer_than`` (monotonic)."""
+        key = (guild.id, action)
+        now = time.monotonic()
+        self._expire(now)
+        cached = self._cache.get(key)
+        if cached and now - cached[0] < self.ttl and (newer_than is None or cached[0] >= newer_than):
+            self.shared += 1
+            return cached[1]
+        inflight = self._inflight.get(key)
+        if inflight and (newer_than is None or inflight[0] >= newer_than):
+            self.shared += 1
+            task = inflight[1]
+        else:
+            task = asyncio.ensure_future(self._fetch(guild, action, key, now))
+            self._inflight[key] = (now, task)
+            task.add_done_callback(lambda t: self._release(key, t))
+        return await asyncio.shield(task)
+
+    def forget_guild(self, guild_id: int) -> None:
+        for key in [k for k in self._cache if k[0] == guild_id]:
+            del self._cache[key]
 
-def rate_limit_allows(settings: Dict[str, Any], key: str, window_seconds: int = 10, limit: int = 3) -> bool:
-    now = utc_now().timestamp()
-    rt = settings.setdefault("recent_triggers", {})
-    arr = rt.get(key, [])
-    arr = [t for t in arr if now - t < window_seconds]
-    arr.append(now)
-    rt[key] = arr
-    return len(arr) <= limit
+
+audit_fetcher = AuditFetchCoalescer()
+
+
+def _match_audit_actor(entries: List[discord.AuditLogEntry], target_id: Optional[int]):
+    for entry in entries:
+        if target_id is None:
+            return entry.user
+        if getattr(entry.target, "id", None) == target_id:
+            return entry.user
+    return None
 
 
 async def fetch_audit_actor(guild: discord.Guild, action: discord.AuditLogAction, target_id: Optional[int] = None):
+    called_at = time.monotonic()
     try:
-        async for entry in guild.audit_logs(limit=6, action=action):
-            if target_id is None:
-                return entry.user
-            try:
-                if getattr(entry.target, "id", None) == target_id:
-                    return entry.user
-            except Exception:
-                continue
+        actor = _match_audit_actor(await audit_fetcher.entries(guild, action), target_id)
+        if actor is None and target_id is not None:
+            # shared page may predate this event; wait for (or start) a fetch issued after it
+            actor = _match_audit_actor(await audit_fetcher.entries(guild, action, newer_than=called_at), target_id)
     except Exception:
         return None
-    return None
+    return actor
+
+
+class AuditAttribution:
+    """In-memory index of gateway audit-log entries used to attribute antinuke events.
+
+    Entries arrive through ``on_audit_log_entry_create`` and are kept per guild in a
+    bounded LRU keyed by ``(action, target_id)``; the latest entry per action is also
+    stored under ``(action, None)`` for events whose target id is unknown. Handlers
+    await a short window for the matching entry since the gateway may deliver it
+    after the event it describes. Events that only matter with an actor (a member
+    removal is a kick only if a kick entry exists) skip the REST fallback; each one
+    is counted in ``rest_avoided``.
+    """
+
+    def __init__(self, per_guild: int = AUDIT_INDEX_SIZE, max_age: float = AUDIT_INDEX_MAX_AGE):
+        self.per_guild = per_guild
+        self.max_age = max_age
+        self._index: Dict[int, "OrderedDict[Tuple[Any, Optional[int]], Tuple[float, discord.AuditLogEntry]]"] = {}
+        self._waiters: Dict[Tuple[int, Any, Optional[int]], List[asyncio.Future]] = {}
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.rest_avoided = 0
+
+    def feed(self, entry: discord.AuditLogEntry) -> None:
+        gid = entry.guild.id
+        idx = self._index.get(gid)
+        if idx is None:
+            idx = self._index[gid] = OrderedDict()
+        now = time.monotonic()
+        tid = getattr(entry.target, "id", None)
+        keys = [(entry.action, None)]
+        if tid is not None:
+            keys.append((entry.action, tid))
+        for key in keys:
+            idx[key] = (now, entry)
+            idx.move_to_end(key)
+            waiters = self._waiters.pop((gid, key[0], key[1]), None)
+            for fut in waiters or ():
+                if not fut.done():
+                    fut.set_result(entry)
+        while len(idx) > self.per_guild:
+            idx.popitem(last=False)
+
+    def lookup(self, guild_id: int, action: discord.AuditLogAction, target_id: Optional[int] = None) -> Optional[discord.AuditLogEntry]:
+        idx = self._index.get(guild_id)
+        if not idx:
+            return None
+        hit = idx.get((action, target_id))
+        if not hit:
+            return None
+        ts, entry = hit
+        if time.monotonic() - ts > self.max_age:
+            return None
+        return entry
+
+    async def wait_for(self, guild_id: int, action: discord.AuditLogAction, target_id: Optional[int] = None,
+                       timeout: float = AUDIT_WAIT_TIMEOUT) -> Optional[discord.AuditLogEntry]:
+        entry = self.lookup(guild_id, action, target_id)
+        if entry is not None:
+            return entry
+        key = (guild_id, action, target_id)
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, []).append(fut)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters and fut in waiters:
+                waiters.remove(fut)
+                if not waiters:
+                    del self._waiters[key]
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._index.pop(guild_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": sum(len(i) for i in self._index.values()), "waiters": sum(len(w) for w in self._waiters.values()),
+                "hits": self.hits, "misses": self.misses, "rest_avoided": self.rest_avoided}
+
+
+audit_index = AuditAttribution()
+
+
+async def resolve_audit_actor(guild: discord.Guild, action: discord.AuditLogAction, target_id: Optional[int] = None,
+                              rest_fallback: bool = True):
+    # gateway index first; REST audit-log fetch only when the index misses and the caller allows it
+    if not guild.me.guild_permissions.view_audit_log:
+        return None
+    entry = await audit_index.wait_for(guild.id, action, target_id)
+    if entry is not None:
+        actor = entry.user
+        if entry.user_id is not None and not isinstance(actor, discord.Member):
+            actor = member_resolver.get(guild, entry.user_id) or actor
+        if actor is not None:
+            audit_index.hits += 1
+            return actor
+    audit_index.misses += 1
+    if not rest_fallback:
+        # with view_audit_log the gateway delivers every entry, so no entry means nothing to attribute
+        audit_index.rest_avoided += 1
+        return None
+    return await fetch_audit_actor(guild, action, target_id=target_id)
 
 
 def parse_panel_loc(stored: Optional[str]) -> Optional[Tuple[int, int]]:
@@ -217,6 +1848,286 @@ def store_panel_loc(channel_id: int, message_id: int) -> str:
     return f"{channel_id}:{message_id}"
 
 
+# ---------------- AUTOMOD LINK MATCHER ----------------
+_LINK_SEP = r"\s*(?:\.|\(\s*\.\s*\)|\[\s*\.\s*\]|\{\s*\.\s*\}|\(\s*dot\s*\)|\[\s*dot\s*\]|\s+dot\s+)\s*"
+_INVITE_HOSTS = frozenset({"discord.gg", "dsc.gg", "invite.gg", "discord.me", "discord.io", "discord.li"})
+_INVITE_PATH_HOSTS = frozenset({"discord.com", "discordapp.com"})
+_INVITE_RE = (
+    r"(?P<inv>(?<![\w-])(?:https?://)?(?:www\.)?"
+    r"(?P<inv_name>discordapp|discord|dsc|invite)" + _LINK_SEP + r"(?P<inv_tld>gg|me|io|li|com)"
+    r"(?P<inv_path>\s*[/\\]\s*[\w-]+(?:\s*[/\\]\s*[\w-]+)?))"
+)
+_URL_RE = r"(?P<url>https?://(?P<url_auth>[^\s/?#<>\\]+)(?P<url_path>[^\s<>]*))"
+_PUNY_RE = r"(?P<puny>(?<![\w.-])(?:[a-z0-9-]+\.)*xn--[a-z0-9-]+(?:\.[a-z0-9-]+)*)"
+# every invite/URL/punycode hit needs one of these; lets plain chat skip the link pattern
+_LINK_PREFILTER = re.compile(r"[/\\]|xn--", re.IGNORECASE)
+_DOMAIN_RE = re.compile(r"(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z0-9-]{2,63}")
+
+
+def normalize_domain(raw: str) -> Optional[str]:
+    text = re.sub(r"^[a-z][a-z0-9+.-]*://", "", raw.strip().lower())
+    text = re.split(r"[/?#:]", text, maxsplit=1)[0].strip(".")
+    if text.startswith("www."):
+        text = text[4:]
+    try:
+        text = text.encode("idna").decode("ascii")
+    except UnicodeError:
+        return None
+    return text if _DOMAIN_RE.fullmatch(text) else None
+
+
+# prose and markdown around a bare link: "https://a.com," "(https://a.com)" "**https://a.com**" "||https://a.com||"
+_URL_HOST_TRAILING = ")]|*_~`'\",;!."
+
+
+def _url_host(authority: str) -> str:
+    # userinfo never names the host ("allowed.com:x@evil.com" goes to evil.com): take what follows the last "@"
+    host = authority.rpartition("@")[2]
+    if host.startswith("["):
+        return host[1:].partition("]")[0]  # IPv6 literal
+    # stripped only after the "@" split, so "allowed.com,@evil.com" still resolves to evil.com
+    return host.partition(":")[0].rstrip(_URL_HOST_TRAILING)
+
+
+def _domain_in(host: str, domains: frozenset) -> bool:
+    # matches the domain itself and any subdomain of it
+    while True:
+        if host in domains:
+            return True
+        dot = host.find(".")
+        if dot < 0:
+            return False
+        host = host[dot + 1:]
+
+
+_LINK_PATTERN = re.compile("|".join((_INVITE_RE, _URL_RE, _PUNY_RE)), re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_deny_pattern(deny: frozenset) -> "re.Pattern[str]":
+    # bare occurrences of a denied domain (or a subdomain of it); shared by guilds with the same list
+    alts = "|".join(re.escape(d) for d in sorted(deny, key=len, reverse=True))
+    return re.compile(r"(?<![\w-])(?:" + alts + r")(?![\w-])", re.IGNORECASE)
+
+
+class LinkMatcher:
+    """Per-guild compiled link/invite matcher.
+
+    A C-level prefilter lets plain chat skip matching entirely; anything else takes one
+    pass of a combined invite/URL/punycode regex, plus one pass of the guild's deny-list
+    regex when it has one. Invites (including spaced/bracketed/"dot" obfuscations and
+    vanity hosts like dsc.gg) and scheme URLs are blocked unless their host is allowed;
+    denied domains are blocked everywhere, and bare punycode hosts are treated as
+    homograph attempts.
+    """
+
+    __slots__ = ("allow", "deny", "_deny_pattern")
+
+    def __init__(self, allow: List[str], deny: List[str]):
+        self.allow = frozenset(filter(None, (normalize_domain(d) for d in allow)))
+        self.deny = frozenset(filter(None, (normalize_domain(d) for d in deny)))
+        self._deny_pattern = _compile_deny_pattern(self.deny) if self.deny else None
+
+    def _check_host(self, host: str) -> Optional[Tuple[str, str]]:
+        if _domain_in(host, self.deny):
+            return "denied domain", host
+        if _domain_in(host, self.allow):
+            return None
+        return "link", host
+
+    def scan(self, content: str) -> Optional[Tuple[str, str]]:
+        """Return ``(reason, host)`` for the first blocked link, or None."""
+        if _LINK_PREFILTER.search(content) is not None:
+            hit = self._scan_links(content)
+            if hit:
+                return hit
+        if self._deny_pattern is not None:
+            m = self._deny_pattern.search(content)
+            if m:
+                return "denied domain", m.group(0).lower()
+        return None
+
+    def _scan_links(self, content: str) -> Optional[Tuple[str, str]]:
+        for m in _LINK_PATTERN.finditer(content):
+            if m.group("inv") is not None:
+                host = f"{m.group('inv_name')}.{m.group('inv_tld')}".lower()
+                if host in _INVITE_PATH_HOSTS:
+                    is_invite = re.match(r"\s*[/\\]\s*invite\b", m.group("inv_path"), re.IGNORECASE) is not None
+                else:
+                    is_invite = host in _INVITE_HOSTS
+                if is_invite:
+                    if not _domain_in(host, self.allow):
+                        return "invite", host
+                elif m.group("inv")[:4].lower() == "http":
+                    # a plain link to one of those hosts (e.g. https://discord.com/channels/...)
+                    hit = self._check_host(host)
+                    if hit:
+                        return hit
+                continue
+            if m.group("url") is not None:
+                raw_host = _url_host(m.group("url_auth")).lower().strip(".")
+                if raw_host.startswith("www."):
+                    raw_host = raw_host[4:]
+                try:
+                    host = raw_host.encode("idna").decode("ascii")
+                except UnicodeError:
+                    return "invalid domain", raw_host
+                if host in _INVITE_HOSTS or (host in _INVITE_PATH_HOSTS
+                                          and m.group("url_path").lower().startswith("/invite")):
+                    if not _domain_in(host, self.allow):
+                        return "invite", host
+                    continue
+                hit = self._check_host(host)
+                if hit:
+                    return hit
+                continue
+            host = m.group("puny").lower()
+            if not _domain_in(host, self.allow):
+                return "punycode domain", host
+        return None
+
+
+_link_matchers: Dict[int, LinkMatcher] = {}
+
+
+def get_link_matcher(guild_id: int, am: Dict[str, Any]) -> LinkMatcher:
+    matcher = _link_matchers.get(guild_id)
+    if matcher is None:
+        matcher = _link_matchers[guild_id] = LinkMatcher(am.get("link_allow_domains", []), am.get("link_deny_domains", []))
+    return matcher
+
+
+def invalidate_link_matcher(guild_id: int) -> None:
+    _link_matchers.pop(guild_id, None)
+
+
+# ---------------- AUTOMOD SPAM DETECTOR ----------------
+# case, spacing, digits and ASCII punctuation don't make a copy-paste "different"
+_SPAM_NOISE = str.maketrans("", "", string.punctuation + string.digits + string.whitespace)
+# only this much of a message is fingerprinted
+SPAM_FINGERPRINT_CHARS = 512
+# per-channel detection ignores fingerprints shorter than this ("gg", "lol" from many people is chat)
+SPAM_CHANNEL_MIN_LENGTH = 10
+
+
+def spam_fingerprint(content: str) -> Tuple[int, int]:
+    """Hash of the normalized message and the normalized length; punctuation-only text falls back to the raw text."""
+    text = content[:SPAM_FINGERPRINT_CHARS]
+    norm = text.casefold().translate(_SPAM_NOISE) or text.strip()
+    return hash(norm), len(norm)
+
+
+class _FingerprintRing:
+    """Ring of (fingerprint, timestamp, owner) slots; grows to ``size`` then overwrites the oldest."""
+
+    __slots__ = ("size", "hashes", "stamps", "owners", "pos")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.hashes: List[int] = []
+        self.stamps: List[float] = []
+        self.owners: List[int] = []
+        self.pos = 0
+
+    def push(self, h: int, owner: int, now: float, window: float) -> int:
+        """Store ``h`` and return how many copies of it (this one included) are within the window."""
+        copies = 1
+        hashes = self.hashes
+        if h in hashes:  # C-level scan; a message with no earlier copy stops here
+            cutoff = now - window
+            stamps = self.stamps
+            for i, hh in enumerate(hashes):
+                if hh == h and stamps[i] > cutoff:
+                    copies += 1
+        if len(hashes) < self.size:
+            hashes.append(h)
+            self.stamps.append(now)
+            self.owners.append(owner)
+        else:
+            i = self.pos
+            hashes[i], self.stamps[i], self.owners[i] = h, now, owner
+            self.pos = (i + 1) % self.size
+        return copies
+
+    def owners_of(self, h: int, now: float, window: float) -> int:
+        cutoff = now - window
+        return len({o for hh, t, o in zip(self.hashes, self.stamps, self.owners) if hh == h and t > cutoff})
+
+
+class SpamDetector:
+    """Copy-paste flood detection from rolling per-author and per-channel fingerprints.
+
+    Each (guild, author) and each channel owns a fixed-size ring of recent message
+    fingerprints, so a check is a fixed number of comparisons regardless of traffic.
+    Per guild at most ``max_authors`` author rings and ``max_channels`` channel rings
+    are kept (least recently active evicted), which caps memory independently of
+    message volume. ``check`` returns a reason when the message is part of a flood.
+    """
+
+    def __init__(self, window: float = SPAM_WINDOW, author_ring: int = SPAM_AUTHOR_RING,
+                 channel_ring: int = SPAM_CHANNEL_RING, max_authors: int = SPAM_MAX_AUTHORS,
+                 max_channels: int = SPAM_MAX_CHANNELS):
+        self.window = window
+        self.author_ring = author_ring
+        self.channel_ring = channel_ring
+        self.max_authors = max_authors
+        self.max_channels = max_channels
+        self._authors: Dict[int, "OrderedDict[int, _FingerprintRing]"] = {}
+        self._channels: Dict[int, "OrderedDict[int, _FingerprintRing]"] = {}
+        self.checked = 0
+        self.flagged = 0
+
+    @staticmethod
+    def _ring(rings: Dict[int, "OrderedDict[int, _FingerprintRing]"], guild_id: int, key: int, size: int,
+              cap: int) -> _FingerprintRing:
+        per_guild = rings.get(guild_id)
+        if per_guild is None:
+            per_guild = rings[guild_id] = OrderedDict()
+        ring = per_guild.get(key)
+        if ring is None:
+            ring = per_guild[key] = _FingerprintRing(size)
+            if len(per_guild) > cap:
+                per_guild.popitem(last=False)
+        else:
+            per_guild.move_to_end(key)
+        return ring
+
+    def check(self, guild_id: int, channel_id: int, author_id: int, content: str, author_threshold: int,
+              channel_threshold: int, now: Optional[float] = None) -> Optional[str]:
+        if not content:
+            return None
+        self.checked += 1
+        now = time.monotonic() if now is None else now
+        h, length = spam_fingerprint(content)
+        author = self._ring(self._authors, guild_id, author_id, self.author_ring, self.max_authors)
+        copies = author.push(h, channel_id, now, self.window)
+        if copies >= min(author_threshold, self.author_ring):
+            self.flagged += 1
+            channels = author.owners_of(h, now, self.window)
+            where = f"across {channels} channels" if channels > 1 else "in one channel"
+            return f"{copies} copies from this user {where} in {self.window:g}s"
+        if length < SPAM_CHANNEL_MIN_LENGTH:
+            return None
+        channel = self._ring(self._channels, guild_id, channel_id, self.channel_ring, self.max_channels)
+        copies = channel.push(h, author_id, now, self.window)
+        if copies >= min(channel_threshold, self.channel_ring):
+            self.flagged += 1
+            return f"{copies} copies from {channel.owners_of(h, now, self.window)} users in this channel in {self.window:g}s"
+        return None
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._authors.pop(guild_id, None)
+        self._channels.pop(guild_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"checked": self.checked, "flagged": self.flagged,
+                "author_rings": sum(len(r) for r in self._authors.values()),
+                "channel_rings": sum(len(r) for r in self._channels.values())}
+
+
+spam_detector = SpamDetector()
+
+
 # ---------------- EMBED + UI BUILDERS ----------------
 def build_guard_embed(guild: Optional[discord.Guild], settings: Dict[str, Any]) -> discord.Embed:
     name = guild.name if guild else "Server"
@@ -245,6 +2156,7 @@ def build_guard_embed(guild: Optional[discord.Guild], settings: Dict[str, Any])
     ]
     for k, label in keys:
         ant_text += f"{bool_mark(bool(ant.get(k, False)))} {label}\n"
+    ant_text += f"{bool_mark(bool(ant.get('nuke_scoring', False)))} Nuke scoring (threshold {ant.get('score_threshold', 10)} in {NUKE_SCORE_WINDOW:g}s)\n"
     ant_text += "\n**Response actions**\n"
     for k in ["remove_roles", "kick_member", "ban_member", "server_lockdown", "unverified_ban", "notify_admins"]:
         ant_text += f"{bool_mark(bool(ant.get('actions', {}).get(k, False)))} {k}\n"
@@ -253,7 +2165,16 @@ def build_guard_embed(guild: Optional[discord.Guild], settings: Dict[str, Any])
     am = settings.get("automod", {})
     am_text = f"{bool_mark(bool(am.get('link_invite_filter', False)))} Link & Invite Filtering\n"
     am_text += f"{bool_mark(bool(am.get('mass_mention_protection', False)))} Mass Mention Protection (threshold {am.get('mass_mention_threshold', 5)})\n"
+    am_text += (f"{bool_mark(bool(am.get('spam_protection', False)))} Spam Protection "
+                f"({am.get('spam_threshold', 4)} copies per user / {am.get('spam_channel_threshold', 6)} per channel in {SPAM_WINDOW:g}s)\n")
+    am_text += f"Link domains: {len(am.get('link_allow_domains', []))} allowed, {len(am.get('link_deny_domains', []))} denied\n"
     embed.add_field(name="🤖 AutoMod", value=am_text, inline=False)
+    # Antiraid
+    ar = settings.get("antiraid", {})
+    ar_text = (f"{bool_mark(bool(ar.get('join_rate_protection', False)))} Join raid protection "
+               f"({ar.get('join_threshold', 10)} joins in {ar.get('join_window', 10)}s)\n")
+    ar_text += f"Response: {ar.get('action', 'timeout')} accounts younger than {ar.get('min_account_age_days', 7)}d\n"
+    embed.add_field(name="🚪 Antiraid", value=ar_text, inline=False)
     # Whitelist
     wl = settings.get("whitelist", {})
     ant_wl = wl.get("antinuke", [])
@@ -264,19 +2185,81 @@ def build_guard_embed(guild: Optional[discord.Guild], settings: Dict[str, Any])
 
 
 # Button & modal labels must be <= 45 chars
-class ToggleButton(discord.ui.Button):
-    def __init__(self, label: str, guild_id: int, key_path: List[str]):
-        # key_path e.g. ["antinuke","channels_deleted"]
-        custom_id = f"toggle:{guild_id}:{':'.join(key_path)}"
-        super().__init__(style=discord.ButtonStyle.secondary, label=(label[:45]), custom_id=custom_id)
+PANEL_TOGGLES: List[Tuple[str, Tuple[str, ...]]] = [
+    # Antinuke toggles
+    ("Channels deleted", ("antinuke", "channels_deleted")),
+    ("Channels created", ("antinuke", "channels_created")),
+    ("Roles deleted", ("antinuke", "roles_deleted")),
+    ("Roles created", ("antinuke", "roles_created")),
+    ("Webhooks created", ("antinuke", "webhooks_created")),
+    ("Member bans", ("antinuke", "member_bans")),
+    ("Member kicks", ("antinuke", "member_kicks")),
+    ("Bots added", ("antinuke", "bots_added")),
+    ("Nuke scoring", ("antinuke", "nuke_scoring")),
+    # Actions (sub toggles)
+    ("Remove roles (action)", ("antinuke", "actions", "remove_roles")),
+    ("Kick member (action)", ("antinuke", "actions", "kick_member")),
+    ("Ban member (action)", ("antinuke", "actions", "ban_member")),
+    ("Server lockdown", ("antinuke", "actions", "server_lockdown")),
+    ("Unverified ban", ("antinuke", "actions", "unverified_ban")),
+    ("Notify admins", ("antinuke", "actions", "notify_admins")),
+    # AutoMod
+    ("Link/invite filter", ("automod", "link_invite_filter")),
+    ("Mass mention protect", ("automod", "mass_mention_protection")),
+    ("Spam protection", ("automod", "spam_protection")),
+    # Antiraid
+    ("Join raid protection", ("antiraid", "join_rate_protection")),
+]
+_PANEL_TOGGLE_PATHS = frozenset(path for _, path in PANEL_TOGGLES)
+
+
+class PanelButton(discord.ui.DynamicItem[discord.ui.Button],
+                  template=r"(?P<kind>toggle|save|wl):(?P<guild_id>[0-9]{15,20})(?::(?P<path>[a-z_]+(?::[a-z_]+)*))?"):
+    """Process-wide router for every control panel button.
+
+    All state lives in the custom_id (``toggle:{guild}:{path}``, ``save:{guild}``,
+    ``wl:{guild}``), which the compiled template parses back on click. The class is
+    registered once with ``bot.add_dynamic_items``, so panels keep working across
+    restarts and nothing is stored per panel message.
+    """
+
+    def __init__(self, kind: str, guild_id: int, key_path: Tuple[str, ...] = (), *,
+                 label: Optional[str] = None, style: discord.ButtonStyle = discord.ButtonStyle.secondary):
+        custom_id = f"{kind}:{guild_id}" + (":" + ":".join(key_path) if key_path else "")
+        super().__init__(discord.ui.Button(style=style, label=label[:45] if label else None, custom_id=custom_id))
+        self.kind = kind
         self.guild_id = guild_id
         self.key_path = key_path
 
-    async def callback(self, interaction: discord.Interaction):
-        # require admin
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: "re.Match[str]", /):
+        path = tuple(match["path"].split(":")) if match["path"] else ()
+        return cls(match["kind"], int(match["guild_id"]), path, label=item.label, style=item.style)
+
+    async def interaction_check(self, interaction: discord.Interaction, /) -> bool:
+        # require admin, and only act on the guild the panel belongs to
         if not isinstance(interaction.user, discord.Member) or not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("Administrator permissions required.", ephemeral=True)
-            return
+            return False
+        if interaction.guild is None or interaction.guild.id != self.guild_id:
+            await interaction.response.send_message("This panel belongs to another server.", ephemeral=True)
+            return False
+        if self.kind == "toggle" and self.key_path not in _PANEL_TOGGLE_PATHS:
+            await interaction.response.send_message("This button is no longer supported.", ephemeral=True)
+            return False
+        return True
+
+    async def callback(self, interaction: discord.Interaction):
+        if self.kind == "toggle":
+            await self._toggle(interaction)
+        elif self.kind == "save":
+            await ack_interaction(interaction)
+            background.spawn(self._save(interaction))
+        else:
+            await interaction.response.send_modal(WhitelistModal(self.guild_id))
+
+    async def _toggle(self, interaction: discord.Interaction):
+        await ack_interaction(interaction)
         sid = str(self.guild_id)
         ensure_guild_data(self.guild_id)
         settings = _db[sid]
@@ -285,26 +2268,16 @@ class ToggleButton(discord.ui.Button):
             obj = obj.setdefault(k, {})
         last = self.key_path[-1]
         obj[last] = not bool(obj.get(last, False))
-        await save_config()
-        # refresh panel if exists
-        guild = interaction.guild
-        await refresh_panel_message(guild, sid)
-        # reply quickly
-        await interaction.response.send_message(f"Toggled `{last}` → {obj[last]}", ephemeral=True)
-
+        touch_settings(sid)
+        # persistence + debounced panel refresh run in the background; outcome comes as a followup
+        refresh = schedule_panel_refresh(interaction.guild, sid)
+        background.spawn(finish_panel_change(interaction, sid, f"Toggled `{last}` → {obj[last]}", refresh))
 
-class SaveButton(discord.ui.Button):
-    def __init__(self, guild_id: int):
-        super().__init__(style=discord.ButtonStyle.success, label="Save & Apply", custom_id=f"save:{guild_id}")
-        self.guild_id = guild_id
-
-    async def callback(self, interaction: discord.Interaction):
-        if not isinstance(interaction.user, discord.Member) or not interaction.user.guild_permissions.administrator:
-            await interaction.response.send_message("Administrator permissions required.", ephemeral=True)
-            return
-        await save_config()
-        await refresh_panel_message(interaction.guild, str(interaction.guild.id))
-        await interaction.response.send_message("Settings saved and applied.", ephemeral=True)
+    async def _save(self, interaction: discord.Interaction):
+        sid = str(self.guild_id)
+        await save_config(sid)
+        await refresh_panel_message(interaction.guild, sid)
+        await finish_panel_change(interaction, sid, "Settings saved and applied.")
 
 
 class WhitelistModal(discord.ui.Modal, title="Manage Whitelist"):
@@ -320,11 +2293,12 @@ class WhitelistModal(discord.ui.Modal, title="Manage Whitelist"):
         if not isinstance(interaction.user, discord.Member) or not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("Administrator permissions required.", ephemeral=True)
             return
+        await ack_interaction(interaction)
         cat = self.category.value.strip().lower()
         ent = self.entry.value.strip()
         act = self.action.value.strip().lower()
         if cat not in ("antinuke", "automod"):
-            await interaction.response.send_message("Category must be 'antinuke' or 'automod'.", ephemeral=True)
+            await interaction.followup.send("Category must be 'antinuke' or 'automod'.", ephemeral=True)
             return
         m_user = re.match(r"<@!?(?P<id>\d+)>", ent)
         m_role = re.match(r"<@&(?P<id>\d+)>", ent)
@@ -336,7 +2310,7 @@ class WhitelistModal(discord.ui.Modal, title="Manage Whitelist"):
         elif ent.isdigit():
             target_id = ent
         if not target_id:
-            await interaction.response.send_message("Couldn't parse mention or ID.", ephemeral=True)
+            await interaction.followup.send("Couldn't parse mention or ID.", ephemeral=True)
             return
         sid = str(self.guild_id)
         ensure_guild_data(self.guild_id)
@@ -344,100 +2318,172 @@ class WhitelistModal(discord.ui.Modal, title="Manage Whitelist"):
         wl = settings.setdefault("whitelist", {}).setdefault(cat, [])
         if act == "add":
             if target_id in wl:
-                await interaction.response.send_message("Already whitelisted.", ephemeral=True)
+                await interaction.followup.send("Already whitelisted.", ephemeral=True)
                 return
             wl.append(target_id)
-            await save_config()
-            await refresh_panel_message(interaction.guild, sid)
-            await interaction.response.send_message("Added to whitelist.", ephemeral=True)
+            done = "Added to whitelist."
         elif act == "remove":
             if target_id not in wl:
-                await interaction.response.send_message("Not in whitelist.", ephemeral=True)
+                await interaction.followup.send("Not in whitelist.", ephemeral=True)
                 return
             wl.remove(target_id)
-            await save_config()
-            await refresh_panel_message(interaction.guild, sid)
-            await interaction.response.send_message("Removed from whitelist.", ephemeral=True)
+            done = "Removed from whitelist."
         else:
-            await interaction.response.send_message("Action must be 'add' or 'remove'.", ephemeral=True)
-
-
-class ManageWhitelistButton(discord.ui.Button):
-    def __init__(self, guild_id: int):
-        super().__init__(style=discord.ButtonStyle.primary, label="Whitelist Manager", custom_id=f"wl:{guild_id}")
-        self.guild_id = guild_id
-
-    async def callback(self, interaction: discord.Interaction):
-        if not isinstance(interaction.user, discord.Member) or not interaction.user.guild_permissions.administrator:
-            await interaction.response.send_message("Administrator permissions required.", ephemeral=True)
+            await interaction.followup.send("Action must be 'add' or 'remove'.", ephemeral=True)
             return
-        modal = WhitelistModal(self.guild_id)
-        await interaction.response.send_modal(modal)
+        whitelist_index.invalidate_guild(self.guild_id)
+        touch_settings(sid)
+        refresh = schedule_panel_refresh(interaction.guild, sid)
+        background.spawn(finish_panel_change(interaction, sid, done, refresh))
 
 
 class GuardView(discord.ui.View):
     def __init__(self, guild_id: int):
         super().__init__(timeout=None)
         self.guild_id = guild_id
-        # Antinuke toggles
-        self.add_item(ToggleButton("Channels deleted", guild_id, ["antinuke", "channels_deleted"]))
-        self.add_item(ToggleButton("Channels created", guild_id, ["antinuke", "channels_created"]))
-        self.add_item(ToggleButton("Roles deleted", guild_id, ["antinuke", "roles_deleted"]))
-        self.add_item(ToggleButton("Roles created", guild_id, ["antinuke", "roles_created"]))
-        self.add_item(ToggleButton("Webhooks created", guild_id, ["antinuke", "webhooks_created"]))
-        self.add_item(ToggleButton("Member bans", guild_id, ["antinuke", "member_bans"]))
-        self.add_item(ToggleButton("Member kicks", guild_id, ["antinuke", "member_kicks"]))
-        self.add_item(ToggleButton("Bots added", guild_id, ["antinuke", "bots_added"]))
-        # Actions (sub toggles)
-        self.add_item(ToggleButton("Remove roles (action)", guild_id, ["antinuke", "actions", "remove_roles"]))
-        self.add_item(ToggleButton("Kick member (action)", guild_id, ["antinuke", "actions", "kick_member"]))
-        self.add_item(ToggleButton("Ban member (action)", guild_id, ["antinuke", "actions", "ban_member"]))
-        self.add_item(ToggleButton("Server lockdown", guild_id, ["antinuke", "actions", "server_lockdown"]))
-        self.add_item(ToggleButton("Unverified ban", guild_id, ["antinuke", "actions", "unverified_ban"]))
-        self.add_item(ToggleButton("Notify admins", guild_id, ["antinuke", "actions", "notify_admins"]))
-        # AutoMod
-        self.add_item(ToggleButton("Link/invite filter", guild_id, ["automod", "link_invite_filter"]))
-        self.add_item(ToggleButton("Mass mention protect", guild_id, ["automod", "mass_mention_protection"]))
+        for label, path in PANEL_TOGGLES:
+            self.add_item(PanelButton("toggle", guild_id, path, label=label))
         # whitelist manager and save
-        self.add_item(ManageWhitelistButton(guild_id))
-        self.add_item(SaveButton(guild_id))
+        self.add_item(PanelButton("wl", guild_id, label="Whitelist Manager", style=discord.ButtonStyle.primary))
+        self.add_item(PanelButton("save", guild_id, label="Save & Apply", style=discord.ButtonStyle.success))
 
 
 def build_guard_view(guild_id: int) -> GuardView:
     return GuardView(guild_id)
 
 
-async def refresh_panel_message(guild: discord.Guild, sid: str) -> None:
-    settings = _db.get(sid)
-    if not settings:
-        return
-    panel = settings.get("panel_message")
-    if not panel:
-        return
-    loc = parse_panel_loc(panel)
-    if not loc:
-        return
-    ch_id, msg_id = loc
-    ch = guild.get_channel(ch_id)
-    if not ch:
-        # channel removed; clear panel reference
-        settings["panel_message"] = None
-        await save_config()
-        return
-    try:
-        msg = await ch.fetch_message(msg_id)
-    except Exception:
+class PanelRefresher:
+    """Debounced, render-cached control panel updates.
+
+    ``schedule`` coalesces every refresh request for a guild that arrives within
+    ``delay`` seconds into a single edit. The panel message is kept as a
+    PartialMessage (no fetch before editing), the embed is memoized against the
+    guild's settings version, and an edit is skipped entirely when the panel already
+    shows that version.
+    """
+
+    def __init__(self, delay: float = PANEL_REFRESH_DELAY):
+        self.delay = delay
+        self._pending: Dict[int, asyncio.Task] = {}
+        # guild_id -> (stored panel loc, message)
+        self._messages: Dict[int, Tuple[str, Any]] = {}
+        # guild_id -> (render key, embed)
+        self._renders: Dict[int, Tuple[Tuple, discord.Embed]] = {}
+        # guild_id -> (stored panel loc, render key) last shown on the panel
+        self._applied: Dict[int, Tuple[str, Tuple]] = {}
+        self.edits = 0
+        self.skipped = 0
+        self.coalesced = 0
+
+    def render(self, guild: discord.Guild, settings: Dict[str, Any]) -> Tuple[Tuple, discord.Embed]:
+        key = (settings_version(guild.id), guild.name, guild.icon.key if guild.icon else None)
+        cached = self._renders.get(guild.id)
+        if cached is None or cached[0] != key:
+            cached = self._renders[guild.id] = (key, build_guard_embed(guild, settings))
+        return cached
+
+    def remember(self, guild_id: int, panel: str, message: Any, render_key: Tuple) -> None:
+        self._messages[guild_id] = (panel, message)
+        self._applied[guild_id] = (panel, render_key)
+
+    def forget(self, guild_id: int) -> None:
+        self._messages.pop(guild_id, None)
+        self._renders.pop(guild_id, None)
+        self._applied.pop(guild_id, None)
+
+    def schedule(self, guild: discord.Guild, sid: str) -> asyncio.Task:
+        task = self._pending.get(guild.id)
+        if task is not None and not task.done():
+            self.coalesced += 1
+            return task
+        task = self._pending[guild.id] = asyncio.create_task(self._delayed(guild, sid), name=f"guardian-panel-{guild.id}")
+        return task
+
+    async def _delayed(self, guild: discord.Guild, sid: str) -> None:
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            # requests arriving during the edit below schedule a fresh refresh
+            self._pending.pop(guild.id, None)
+        try:
+            await self.refresh(guild, sid)
+        except Exception as e:
+            print("Panel refresh failed:", e)
+
+    def _clear_panel(self, guild_id: int, sid: str, settings: Dict[str, Any]) -> None:
         settings["panel_message"] = None
-        await save_config()
-        return
-    embed = build_guard_embed(guild, settings)
-    view = build_guard_view(int(sid))
+        self.forget(guild_id)
+        touch_settings(sid)
+
+    async def refresh(self, guild: discord.Guild, sid: str) -> None:
+        settings = _db.get(sid)
+        if not settings:
+            return
+        panel = settings.get("panel_message")
+        if not panel:
+            return
+        loc = parse_panel_loc(panel)
+        if not loc:
+            return
+        cached = self._messages.get(guild.id)
+        if cached is not None and cached[0] == panel:
+            msg = cached[1]
+        else:
+            ch_id, msg_id = loc
+            ch = guild.get_channel(ch_id)
+            if not ch:
+                # channel removed; clear panel reference
+                self._clear_panel(guild.id, sid, settings)
+                return
+            msg = ch.get_partial_message(msg_id)
+            self._messages[guild.id] = (panel, msg)
+        key, embed = self.render(guild, settings)
+        if self._applied.get(guild.id) == (panel, key):
+            self.skipped += 1
+            return
+        try:
+            await rest.run(RestPriority.COSMETIC, msg.edit, embed=embed, view=build_guard_view(int(sid)))
+        except (discord.NotFound, discord.Forbidden):
+            # panel deleted or no longer editable; clear panel
+            self._clear_panel(guild.id, sid, settings)
+            return
+        except discord.HTTPException:
+            # transient failure; the next refresh retries
+            return
+        self._applied[guild.id] = (panel, key)
+        self.edits += 1
+
+
+panel_refresher = PanelRefresher()
+
+
+async def refresh_panel_message(guild: discord.Guild, sid: str) -> None:
+    await panel_refresher.refresh(guild, sid)
+
+
+def schedule_panel_refresh(guild: discord.Guild, sid: str) -> asyncio.Task:
+    return panel_refresher.schedule(guild, sid)
+
+
+async def ack_interaction(interaction: discord.Interaction) -> None:
+    # acknowledge before any persistence/REST work so we stay inside Discord's 3s window
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    ack_stats.record((utc_now() - interaction.created_at).total_seconds() * 1000)
+
+
+async def finish_panel_change(interaction: discord.Interaction, sid: str, message: str,
+                              refresh: Optional[asyncio.Task] = None) -> None:
+    # background half of a panel interaction: wait for persistence (+ panel edit), then report via followup
+    waits = [persister.wait_flushed(sid)]
+    if refresh is not None:
+        waits.append(asyncio.shield(refresh))
+    results = await asyncio.gather(*waits, return_exceptions=True)
+    if results[0] is not True:
+        message += " (not saved yet — will retry)"
     try:
-        await msg.edit(embed=embed, view=view)
+        await interaction.followup.send(message, ephemeral=True)
     except discord.HTTPException:
-        # can't edit (maybe deleted); clear panel
-        settings["panel_message"] = None
-        await save_config()
+        pass
 
 
 # ---------------- SLASH COMMANDS ----------------
@@ -471,8 +2517,9 @@ async def cmd_enable_guard(interaction: discord.Interaction):
     ensure_guild_data(guild.id)
     sid = str(guild.id)
     _db[sid]["guard_enabled"] = True
+    touch_settings(sid)
     # send persistent panel message in current channel
-    embed = build_guard_embed(guild, _db[sid])
+    render_key, embed = panel_refresher.render(guild, _db[sid])
     view = build_guard_view(guild.id)
     try:
         panel_msg = await interaction.channel.send(embed=embed, view=view)
@@ -480,7 +2527,8 @@ async def cmd_enable_guard(interaction: discord.Interaction):
         await interaction.followup.send(f"Failed to deploy panel: {e}", ephemeral=True)
         return
     _db[sid]["panel_message"] = store_panel_loc(panel_msg.channel.id, panel_msg.id)
-    await save_config()
+    panel_refresher.remember(guild.id, _db[sid]["panel_message"], panel_msg, render_key)
+    persister.mark_dirty(sid)
     await interaction.followup.send("Guardian panel deployed in this channel (persistent).", ephemeral=True)
 
 
@@ -495,7 +2543,8 @@ async def cmd_disable_guard(interaction: discord.Interaction):
     sid = str(guild.id)
     _db[sid]["guard_enabled"] = False
     _db[sid]["panel_message"] = None
-    await save_config()
+    panel_refresher.forget(guild.id)
+    touch_settings(sid)
     await interaction.followup.send("Guardian disabled for this server.", ephemeral=True)
 
 
@@ -509,20 +2558,494 @@ async def cmd_set_log_channel(interaction: discord.Interaction, channel: Optiona
     ensure_guild_data(guild.id)
     sid = str(guild.id)
     _db[sid]["log_channel_id"] = channel.id if channel else None
-    await save_config()
+    touch_settings(sid)
     await interaction.followup.send(f"Log channel set to {channel.mention if channel else 'None'}.", ephemeral=True)
 
 
+@tree.command(name="link_domains", description="Manage AutoMod link allow/deny domains (admin only)")
+@app_commands.describe(list_name="Which list to edit", action="add, remove or show", domain="Domain, e.g. example.com")
+async def cmd_link_domains(interaction: discord.Interaction, list_name: Literal["allow", "deny"],
+                           action: Literal["add", "remove", "show"], domain: Optional[str] = None):
+    await interaction.response.defer(ephemeral=True)
+    if not is_admin(interaction):
+        await interaction.followup.send("Administrator permissions required.", ephemeral=True)
+        return
+    guild = interaction.guild
+    ensure_guild_data(guild.id)
+    sid = str(guild.id)
+    domains = _db[sid].setdefault("automod", {}).setdefault(f"link_{list_name}_domains", [])
+    if action == "show":
+        text = ", ".join(f"`{d}`" for d in domains) or "(empty)"
+        await interaction.followup.send(f"{list_name.capitalize()} list: {text}"[:2000], ephemeral=True)
+        return
+    norm = normalize_domain(domain or "")
+    if not norm:
+        await interaction.followup.send("Couldn't parse domain.", ephemeral=True)
+        return
+    if action == "add":
+        if norm in domains:
+            await interaction.followup.send("Already listed.", ephemeral=True)
+            return
+        domains.append(norm)
+    else:
+        if norm not in domains:
+            await interaction.followup.send("Not listed.", ephemeral=True)
+            return
+        domains.remove(norm)
+    invalidate_link_matcher(guild.id)
+    touch_settings(sid)
+    schedule_panel_refresh(guild, sid)
+    await interaction.followup.send(f"{'Added' if action == 'add' else 'Removed'} `{norm}` ({list_name} list).", ephemeral=True)
+
+
+@tree.command(name="nuke_threshold", description="Set the nuke score that triggers punishment (admin only)")
+@app_commands.describe(score=f"Points within {NUKE_SCORE_WINDOW:g}s that trigger a response")
+async def cmd_nuke_threshold(interaction: discord.Interaction, score: app_commands.Range[int, 1, 1000]):
+    await interaction.response.defer(ephemeral=True)
+    if not is_admin(interaction):
+        await interaction.followup.send("Administrator permissions required.", ephemeral=True)
+        return
+    guild = interaction.guild
+    ensure_guild_data(guild.id)
+    sid = str(guild.id)
+    _db[sid].setdefault("antinuke", {})["score_threshold"] = score
+    touch_settings(sid)
+    schedule_panel_refresh(guild, sid)
+    weights = ", ".join(f"{k} {v}" for k, v in NUKE_WEIGHTS.items())
+    await interaction.followup.send(f"Nuke score threshold set to {score}. Weights: {weights}.", ephemeral=True)
+
+
+@tree.command(name="raid_settings", description="Configure join raid detection and response (admin only)")
+@app_commands.describe(joins="Joins that count as a raid...", window="...within this many seconds",
+                       min_account_age_days="Accounts younger than this joining during a raid are contained",
+                       action="What to do with them", timeout_minutes="Timeout length when action is timeout")
+async def cmd_raid_settings(interaction: discord.Interaction,
+                            joins: Optional[app_commands.Range[int, 3, 500]] = None,
+                            window: Optional[app_commands.Range[int, 2, 300]] = None,
+                            min_account_age_days: Optional[app_commands.Range[int, 0, 365]] = None,
+                            action: Optional[Literal["timeout", "ban", "none"]] = None,
+                            timeout_minutes: Optional[app_commands.Range[int, 1, 40320]] = None):
+    await interaction.response.defer(ephemeral=True)
+    if not is_admin(interaction):
+        await interaction.followup.send("Administrator permissions required.", ephemeral=True)
+        return
+    guild = interaction.guild
+    ensure_guild_data(guild.id)
+    sid = str(guild.id)
+    ar = _db[sid].setdefault("antiraid", {})
+    changes = {"join_threshold": joins, "join_window": window, "min_account_age_days": min_account_age_days,
+               "action": action, "timeout_minutes": timeout_minutes}
+    changes = {k: v for k, v in changes.items() if v is not None}
+    if changes:
+        ar.update(changes)
+        touch_settings(sid)
+        schedule_panel_refresh(guild, sid)
+    response = ar.get("action", "timeout")
+    if response == "timeout":
+        response += f" ({ar.get('timeout_minutes', 60)} min)"
+    await interaction.followup.send(
+        f"Join raid protection {'on' if ar.get('join_rate_protection', False) else 'off'} (toggle it on the panel): "
+        f"{ar.get('join_threshold', 10)} joins in {ar.get('join_window', 10)}s; "
+        f"accounts younger than {ar.get('min_account_age_days', 7)}d get: {response}.", ephemeral=True)
+
+
+def format_timing_rows(rows: List[Tuple[str, int, int, List[float]]], limit: int = 8) -> str:
+    if not rows:
+        return "(no samples yet)"
+    lines = [f"{name[:22]:<22} {total:>7} {p50:>7.1f} {p95:>7.1f} {p99:>7.1f}"
+             for name, total, _, (p50, p95, p99) in rows[:limit]]
+    if len(rows) > limit:
+        lines.append(f"+{len(rows) - limit} more")
+    text = "\n".join([f"{'name':<22} {'calls':>7} {'p50':>7} {'p95':>7} {'p99':>7}"] + lines)
+    return f"```\n{text[:990]}\n```"
+
+
+@tree.command(name="guard_stats", description="Handler and containment latency for this server and globally (admin only)")
+async def cmd_guard_stats(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    if not is_admin(interaction):
+        await interaction.followup.send("Administrator permissions required.", ephemeral=True)
+        return
+    guild = interaction.guild
+    window = f"last {timings.window:g}-{2 * timings.window:g}s, ms"
+    embed = discord.Embed(title="Guardian — Stats", description=f"Percentiles over the {window}.",
+                          color=EMBED_COLOR, timestamp=utc_now())
+    embed.add_field(name="Handlers (this server)", value=format_timing_rows(timings.summary(guild.id, "event:")), inline=False)
+    embed.add_field(name="Stages (this server)", value=format_timing_rows(timings.summary(guild.id, "stage:")), inline=False)
+    embed.add_field(name="Handlers (global)", value=format_timing_rows(timings.summary(None, "event:")), inline=False)
+    embed.add_field(name="Stages (global)", value=format_timing_rows(timings.summary(None, "stage:")), inline=False)
+    embed.add_field(name="REST call / queue wait (global)",
+                    value=format_timing_rows(timings.summary(None, "rest:") + timings.summary(None, "rest_wait:")), inline=False)
+    counters = (f"Latency: {_latency_ms(bot.latency) or '-'} ms · loop lag {loop_lag.last * 1000:.1f} ms "
+                f"(max {loop_lag.max * 1000:.1f})\n"
+                f"Events: {events_handled.total():g} · handler errors: {event_errors.total():g}\n"
+                f"Audit: {audit_index.hits} gateway hits, {audit_fetcher.requests} REST fetches, "
+                f"{audit_index.rest_avoided} lookups avoided\n"
+                f"Members: cache {MEMBER_CACHE}, {member_resolver.fetches} fetched, {member_resolver.hits} LRU hits\n"
+                f"Queues: log {log_pipeline.queue_depth()}, REST {sum(st['depth'] for st in rest.stats().values())}, "
+                f"config pending {persister.stats()['pending']}")
+    embed.add_field(name="Counters", value=counters, inline=False)
+    lockdown = lockdown_engine.progress.get(guild.id)
+    if lockdown is not None:
+        embed.add_field(name="Lockdown", value=format_lockdown_progress(lockdown), inline=False)
+    if profiler.enabled:
+        top = "\n".join(f"{n / max(profiler.samples, 1) * 100:5.1f}% {frame}" for frame, n in profiler.top(5))
+        embed.add_field(name=f"Profiler ({profiler.samples} samples, {profiler.idle} idle)",
+                        value=f"```\n{top[:990] or '(no busy samples)'}\n```", inline=False)
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+@tree.command(name="unlock", description="Restore channel permissions saved by the last lockdown (admin only)")
+async def cmd_unlock(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    if not is_admin(interaction):
+        await interaction.followup.send("Administrator permissions required.", ephemeral=True)
+        return
+    guild = interaction.guild
+    ensure_guild_data(guild.id)
+    settings = _db[str(guild.id)]
+    if not settings.get("lockdown_snapshot"):
+        await interaction.followup.send("No lockdown to undo.", ephemeral=True)
+        return
+    if not guild.me.guild_permissions.manage_channels:
+        await interaction.followup.send("Missing Manage Channels permission.", ephemeral=True)
+        return
+    res = await lockdown_engine.unlock(guild, settings)
+    text = format_lockdown_result(res, "Restored")
+    if settings.get("lockdown_snapshot"):
+        text += " — run /unlock again to retry the rest."
+    await interaction.followup.send(text, ephemeral=True)
+
+
 # ---------------- PUNISHMENT ENGINE ----------------
-async def perform_punishments(guild: discord.Guild, actor: Optional[discord.Member], category: str, target: Optional[Any], settings: Dict[str, Any]):
-    if not settings.get("guard_enabled", False):
+class _ActorScore:
+    __slots__ = ("counts", "total", "epoch", "tripped", "categories")
+
+    def __init__(self, buckets: int, epoch: int):
+        self.counts = [0] * buckets
+        self.total = 0
+        self.epoch = epoch
+        self.tripped = False
+        self.categories: Dict[str, int] = {}
+
+
+class NukeScorer:
+    """Weighted per-(guild, actor) event score over a sliding window of time buckets.
+
+    The window is a fixed ring of ``buckets`` counters, so recording an event is O(1)
+    (advancing expires at most ``buckets`` slots). ``record`` returns True only on the
+    event that takes an actor's total to the threshold; the actor is re-armed once the
+    total drops below it again. Each guild tracks at most ``max_actors`` actors (least
+    recently active evicted first) and idle actors are dropped after a full window.
+    """
+
+    def __init__(self, window: float = NUKE_SCORE_WINDOW, buckets: int = NUKE_SCORE_BUCKETS,
+                 max_actors: int = NUKE_SCORE_MAX_ACTORS, weights: Optional[Dict[str, int]] = None):
+        self.buckets = buckets
+        self.width = window / buckets
+        self.max_actors = max_actors
+        self.weights = weights or NUKE_WEIGHTS
+        self._guilds: Dict[int, "OrderedDict[int, _ActorScore]"] = {}
+        self.events = 0
+        self.trips = 0
+
+    def _advance(self, score: _ActorScore, epoch: int) -> None:
+        if epoch - score.epoch >= self.buckets:
+            score.counts = [0] * self.buckets
+            score.total = 0
+        else:
+            for e in range(score.epoch + 1, epoch + 1):
+                idx = e % self.buckets
+                score.total -= score.counts[idx]
+                score.counts[idx] = 0
+        score.epoch = epoch
+        if score.total <= 0:
+            score.categories.clear()
+
+    def record(self, guild_id: int, actor_id: int, category: str, threshold: int,
+               now: Optional[float] = None) -> bool:
+        self.events += 1
+        epoch = int((time.monotonic() if now is None else now) / self.width)
+        actors = self._guilds.get(guild_id)
+        if actors is None:
+            actors = self._guilds[guild_id] = OrderedDict()
+        score = actors.get(actor_id)
+        if score is None:
+            score = actors[actor_id] = _ActorScore(self.buckets, epoch)
+        else:
+            actors.move_to_end(actor_id)
+            if epoch != score.epoch:
+                self._advance(score, epoch)
+        weight = self.weights.get(category, 1)
+        score.counts[epoch % self.buckets] += weight
+        score.total += weight
+        score.categories[category] = score.categories.get(category, 0) + 1
+        self._evict(actors, epoch)
+        if score.total < threshold:
+            score.tripped = False
+            return False
+        if score.tripped:
+            return False
+        score.tripped = True
+        self.trips += 1
+        return True
+
+    def _evict(self, actors: "OrderedDict[int, _ActorScore]", epoch: int) -> None:
+        while len(actors) > self.max_actors:
+            actors.popitem(last=False)
+        while actors:
+            oldest = next(iter(actors.values()))
+            if epoch - oldest.epoch < self.buckets:
+                break
+            actors.popitem(last=False)
+
+    def describe(self, guild_id: int, actor_id: int) -> str:
+        score = self._guilds.get(guild_id, {}).get(actor_id)
+        if score is None:
+            return "no recent events"
+        parts = ", ".join(f"{cat} ×{n}" for cat, n in score.categories.items())
+        return f"score {score.total} in {self.width * self.buckets:g}s ({parts})"
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+
+nuke_scorer = NukeScorer()
+
+
+class Incident:
+    """One coalesced antinuke response for a (guild, actor) and every trigger folded into it."""
+
+    __slots__ = ("key", "started", "counts", "targets", "extra_targets", "details")
+
+    MAX_TARGETS = 10
+
+    def __init__(self, key: Tuple[int, Optional[int]]):
+        self.key = key
+        self.started = time.monotonic()
+        self.counts: Dict[str, int] = {}
+        self.targets: List[str] = []
+        self.extra_targets = 0
+        self.details: List[str] = []
+
+    def add(self, category: str, target: Optional[Any], details: Optional[str]) -> None:
+        self.counts[category] = self.counts.get(category, 0) + 1
+        if target is not None:
+            if len(self.targets) < self.MAX_TARGETS:
+                self.targets.append(str(getattr(target, "name", target)))
+            else:
+                self.extra_targets += 1
+        if details and details not in self.details:
+            self.details.append(details)
+
+    @property
+    def events(self) -> int:
+        return sum(self.counts.values())
+
+    def annotate(self, embed: discord.Embed) -> None:
+        if self.events <= 1:
+            return
+        elapsed = time.monotonic() - self.started
+        breakdown = ", ".join(f"{cat} ×{n}" for cat, n in self.counts.items())
+        embed.add_field(name="Incident", value=f"{self.events} events in {elapsed:.1f}s: {breakdown}"[:1024], inline=False)
+        if len(self.targets) > 1:
+            text = ", ".join(self.targets)
+            if self.extra_targets:
+                text += f" (+{self.extra_targets} more)"
+            embed.add_field(name="Targets", value=text[:1024], inline=False)
+        for extra in self.details[1:]:
+            embed.add_field(name="Details", value=extra[:1024], inline=False)
+
+
+class PunishmentRegistry:
+    """In-flight antinuke responses keyed by (guild, actor).
+
+    The first trigger opens an incident and runs the response; triggers arriving while
+    it runs (plus ``linger`` seconds after) attach to it, so a 50-channel burst costs
+    one set of REST actions and one log embed with aggregated counts.
+    """
+
+    def __init__(self, linger: float = INCIDENT_LINGER):
+        self.linger = linger
+        self._open: Dict[Tuple[int, Optional[int]], Incident] = {}
+        self.incidents = 0
+        self.attached = 0
+
+    def attach(self, guild_id: int, actor_id: Optional[int], category: str, target: Optional[Any],
+               details: Optional[str]) -> bool:
+        incident = self._open.get((guild_id, actor_id))
+        if incident is None:
+            return False
+        incident.add(category, target, details)
+        self.attached += 1
+        return True
+
+    def open(self, guild_id: int, actor_id: Optional[int], category: str, target: Optional[Any],
+             details: Optional[str]) -> Incident:
+        incident = self._open[(guild_id, actor_id)] = Incident((guild_id, actor_id))
+        incident.add(category, target, details)
+        self.incidents += 1
+        return incident
+
+    def close(self, incident: Incident) -> None:
+        if self._open.get(incident.key) is incident:
+            del self._open[incident.key]
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+
+punishment_registry = PunishmentRegistry()
+
+
+class LockdownEngine:
+    """Concurrent, reversible lockdown of text channels for @everyone.
+
+    Channel edits run concurrently, bounded by ``concurrency`` so a large guild does not
+    burst past the global REST limit (discord.py still waits out any 429s per route).
+    The original @everyone overwrite of each channel is snapshotted into
+    ``settings["lockdown_snapshot"]`` (persisted, so /unlock works after a restart)
+    before it is first changed; ``unlock`` restores exactly those overwrites.
+    """
+
+    def __init__(self, concurrency: int = LOCKDOWN_CONCURRENCY):
+        self.concurrency = concurrency
+        self._guild_locks: Dict[int, asyncio.Lock] = {}
+        # guild_id -> live progress of the running lock/unlock, shown by /guard_stats and /health
+        self.progress: Dict[int, Dict[str, Any]] = {}
+
+    def running(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [{"guild": gid, "op": st["op"], "done": st["done"], "failed": st["failed"], "total": st["total"],
+                 "elapsed_s": round(now - st["started"], 1)} for gid, st in self.progress.items()]
+
+    async def _run(self, guild: discord.Guild, op: str, jobs: List[Any]) -> Dict[str, Any]:
+        sem = asyncio.Semaphore(self.concurrency)
+        state = self.progress[guild.id] = {"op": op, "total": len(jobs), "done": 0, "failed": 0,
+                                           "started": time.monotonic()}
+
+        async def run_one(job):
+            async with sem:
+                try:
+                    await job()
+                    state["done"] += 1
+                    return True
+                except Exception:
+                    state["failed"] += 1
+                    return False
+
+        results = await asyncio.gather(*(run_one(job) for job in jobs))
+        state["elapsed"] = time.monotonic() - state["started"]
+        self.progress.pop(guild.id, None)
+        return {**state, "results": results}
+
+    async def lock(self, guild: discord.Guild, settings: Dict[str, Any], reason: str = "Guardian lockdown") -> Dict[str, Any]:
+        async with self._guild_locks.setdefault(guild.id, asyncio.Lock()):
+            everyone = guild.default_role
+            snapshot = settings.setdefault("lockdown_snapshot", {})
+            jobs = []
+            for ch in guild.text_channels:
+                current = ch.overwrites.get(everyone)
+                if str(ch.id) not in snapshot:
+                    pair = current.pair() if current is not None else None
+                    snapshot[str(ch.id)] = [pair[0].value, pair[1].value] if pair else None
+                overwrite = current or discord.PermissionOverwrite()
+                if overwrite.send_messages is False:
+                    continue
+                overwrite.send_messages = False
+                jobs.append(functools.partial(rest.run, RestPriority.LOCKDOWN, ch.set_permissions, everyone, overwrite=overwrite, reason=reason))
+            persister.mark_dirty(guild.id)
+            return await self._run(guild, "lock", jobs)
+
+    async def unlock(self, guild: discord.Guild, settings: Dict[str, Any], reason: str = "Guardian unlock") -> Dict[str, Any]:
+        async with self._guild_locks.setdefault(guild.id, asyncio.Lock()):
+            everyone = guild.default_role
+            snapshot = settings.get("lockdown_snapshot") or {}
+            keys, jobs = [], []
+            for cid, pair in snapshot.items():
+                ch = guild.get_channel(int(cid))
+                if ch is None:
+                    continue
+                if pair is None:
+                    overwrite = None
+                else:
+                    overwrite = discord.PermissionOverwrite.from_pair(discord.Permissions(pair[0]), discord.Permissions(pair[1]))
+                keys.append(cid)
+                jobs.append(functools.partial(rest.run, RestPriority.LOCKDOWN, ch.set_permissions, everyone, overwrite=overwrite, reason=reason))
+            res = await self._run(guild, "unlock", jobs)
+            # keep only the channels that still need restoring
+            remaining = {cid: snapshot[cid] for cid, ok in zip(keys, res["results"]) if not ok}
+            if remaining:
+                settings["lockdown_snapshot"] = remaining
+            else:
+                settings.pop("lockdown_snapshot", None)
+            persister.mark_dirty(guild.id)
+            return res
+
+
+lockdown_engine = LockdownEngine()
+
+
+def format_lockdown_progress(state: Dict[str, Any]) -> str:
+    text = f"{state['op']} running: {state['done']}/{state['total']} channels after {time.monotonic() - state['started']:.1f}s"
+    if state["failed"]:
+        text += f" ({state['failed']} failed)"
+    return text
+
+
+def format_lockdown_result(res: Dict[str, Any], verb: str) -> str:
+    text = f"{verb} {res['done']}/{res['total']} channels in {res['elapsed']:.1f}s"
+    if res["failed"]:
+        text += f" ({res['failed']} failed)"
+    return text
+
+
+async def perform_punishments(guild: discord.Guild, actor: Optional[discord.Member], category: str, target: Optional[Any], settings: Dict[str, Any],
+                              details: Optional[str] = None):
+    cs = guild_settings(guild.id)
+    if not cs.guard_enabled:
+        return
+    # triggers for an actor with an open incident join it instead of starting another response
+    if punishment_registry.attach(guild.id, actor.id if actor else None, category, target, details):
+        punishments.inc(category, "coalesced")
         return
-    ant = settings.get("antinuke", {})
-    actions = ant.get("actions", {})
     # rate-limit triggers
     key = f"{category}:{actor.id if actor else 'anon'}"
-    if not rate_limit_allows(settings, key, window_seconds=10, limit=2):
+    if not rate_limit_allows(guild.id, key, window_seconds=10, limit=2):
+        punishments.inc(category, "rate_limited")
         return
+    punishments.inc(category, "executed")
+    incident = punishment_registry.open(guild.id, actor.id if actor else None, category, target, details)
+    try:
+        t0 = time.perf_counter()
+        embed = await _execute_response(guild, actor, category, target, settings, cs.actions, details)
+        done = time.perf_counter()
+        punishment_seconds.observe(done - t0)
+        timings.record("stage:response", done - t0, guild.id)
+        arrived = event_started.get()
+        if arrived is not None:
+            # event arrival -> response finished (audit lookup + queueing + REST actions)
+            timings.record("stage:containment", done - arrived, guild.id)
+    except BaseException:
+        punishment_registry.close(incident)
+        raise
+    # the handler returns now; the incident lingers (and reports) in the background
+    background.spawn(_close_incident(guild, incident, embed), name=f"guardian-incident-{guild.id}")
+
+
+async def _close_incident(guild: discord.Guild, incident: Incident, embed: discord.Embed) -> None:
+    # keep the incident open briefly so triggers right behind this one are folded in
+    try:
+        await asyncio.sleep(punishment_registry.linger)
+    finally:
+        punishment_registry.close(incident)
+    incident.annotate(embed)
+    # Send log embed to log channel or admins
+    send_log_embed(guild, embed)
+
+
+async def _execute_response(guild: discord.Guild, actor: Optional[discord.Member], category: str, target: Optional[Any],
+                            settings: Dict[str, Any], actions: frozenset, details: Optional[str]) -> discord.Embed:
     embed = discord.Embed(title="Guardian — Antinuke Trigger", color=discord.Color.red(), timestamp=utc_now())
     embed.add_field(name="Trigger", value=category, inline=False)
     if actor:
@@ -532,201 +3055,497 @@ async def perform_punishments(guild: discord.Guild, actor: Optional[discord.Memb
             embed.add_field(name="Target", value=str(getattr(target, "name", str(target))), inline=True)
         except Exception:
             pass
+    if details:
+        embed.add_field(name="Details", value=details[:1024], inline=False)
     # remove_roles
-    if actions.get("remove_roles", False) and isinstance(actor, discord.Member):
+    if "remove_roles" in actions and isinstance(actor, discord.Member):
         try:
-            if actor == guild.owner:
+            if actor.id == guild.owner_id:
                 embed.add_field(name="Remove roles", value="Prevented (owner)", inline=False)
             else:
                 roles = [r for r in actor.roles if r != guild.default_role and r < guild.me.top_role]
                 if roles and guild.me.guild_permissions.manage_roles:
-                    await actor.remove_roles(*roles, reason="Guardian remove_roles")
+                    await rest.run(RestPriority.CONTAINMENT, actor.remove_roles, *roles, reason="Guardian remove_roles")
                     embed.add_field(name="Remove roles", value=f"Removed {len(roles)} roles", inline=False)
         except Exception as e:
             embed.add_field(name="Remove roles failed", value=str(e), inline=False)
     # kick_member
-    if actions.get("kick_member", False) and isinstance(actor, discord.Member):
+    if "kick_member" in actions and isinstance(actor, discord.Member):
         try:
-            if actor == guild.owner:
+            if actor.id == guild.owner_id:
                 embed.add_field(name="Kick", value="Prevented (owner)", inline=False)
             elif guild.me.guild_permissions.kick_members:
-                await actor.kick(reason=f"Guardian auto-kick for {category}")
+                await rest.run(RestPriority.CONTAINMENT, actor.kick, reason=f"Guardian auto-kick for {category}")
                 embed.add_field(name="Kick", value="Actor kicked", inline=False)
         except Exception as e:
             embed.add_field(name="Kick failed", value=str(e), inline=False)
     # ban_member
-    if actions.get("ban_member", False) and isinstance(actor, discord.Member):
+    if "ban_member" in actions and isinstance(actor, discord.Member):
         try:
-            if actor == guild.owner:
+            if actor.id == guild.owner_id:
                 embed.add_field(name="Ban", value="Prevented (owner)", inline=False)
             elif guild.me.guild_permissions.ban_members:
-                await guild.ban(actor, reason=f"Guardian auto-ban for {category}", delete_message_days=1)
+                await rest.run(RestPriority.CONTAINMENT, guild.ban, actor, reason=f"Guardian auto-ban for {category}", delete_message_days=1)
                 embed.add_field(name="Ban", value="Actor banned", inline=False)
         except Exception as e:
             embed.add_field(name="Ban failed", value=str(e), inline=False)
     # server_lockdown
-    if actions.get("server_lockdown", False):
-        count = 0
+    if "server_lockdown" in actions:
         if guild.me.guild_permissions.manage_channels:
-            for ch in guild.text_channels:
-                try:
-                    overwrite = ch.overwrites_for(guild.default_role)
-                    overwrite.send_messages = False
-                    await ch.set_permissions(guild.default_role, overwrite=overwrite, reason="Guardian lockdown")
-                    count += 1
-                except Exception:
-                    continue
-            embed.add_field(name="Server lockdown", value=f"Locked {count} channels (where permitted)", inline=False)
+            res = await lockdown_engine.lock(guild, settings)
+            embed.add_field(name="Server lockdown", value=format_lockdown_result(res, "Locked") + "\nUse /unlock to restore.", inline=False)
         else:
             embed.add_field(name="Server lockdown", value="Missing Manage Channels permission", inline=False)
     # unverified_ban
-    if actions.get("unverified_ban", False) and isinstance(actor, discord.Member):
+    if "unverified_ban" in actions and isinstance(actor, discord.Member):
         try:
             age_days = (utc_now() - actor.created_at).days
             if age_days < 7 and guild.me.guild_permissions.ban_members:
-                await guild.ban(actor, reason="Guardian unverified_ban", delete_message_days=1)
+                await rest.run(RestPriority.CONTAINMENT, guild.ban, actor, reason="Guardian unverified_ban", delete_message_days=1)
                 embed.add_field(name="Unverified ban", value=f"Banned actor (age {age_days}d)", inline=False)
         except Exception as e:
             embed.add_field(name="Unverified ban failed", value=str(e), inline=False)
-    # Send log embed to log channel or admins
-    await send_log_embed(guild, embed, settings)
+    return embed
+
+
+# ---------------- ANTIRAID ----------------
+# upper bounds (seconds) of the account-age histogram bins; the last bin is open-ended
+ACCOUNT_AGE_BINS = (3600, 86400, 7 * 86400, 30 * 86400, 365 * 86400)
+ACCOUNT_AGE_LABELS = ("<1h", "<1d", "<7d", "<30d", "<1y", "older")
+
+
+class _GuildJoins:
+    __slots__ = ("joins", "hist", "raid_until", "raid_started")
+
+    def __init__(self):
+        self.joins: deque = deque()  # (joined_at, member_id, account_age, bin)
+        self.hist = [0] * len(ACCOUNT_AGE_LABELS)
+        self.raid_until = 0.0
+        self.raid_started = 0.0
+
+
+class JoinRateMonitor:
+    """Per-guild join rate over a sliding window, with an account-age histogram of that window.
+
+    Joins are kept in a deque of at most ``max_joins`` entries; expiring and appending
+    update the histogram incrementally, so ``record`` is amortized O(1). A raid starts
+    when the window holds ``threshold`` joins and stays active for ``cooldown`` seconds
+    after the last spike. ``record`` returns whether this join started a raid and the
+    ids to contain: every young account in the window when a raid starts, afterwards
+    just the joiner if it is young.
+    """
+
+    def __init__(self, max_joins: int = RAID_JOIN_BUFFER, cooldown: float = RAID_COOLDOWN):
+        self.max_joins = max_joins
+        self.cooldown = cooldown
+        self._guilds: Dict[int, _GuildJoins] = {}
+        self.joins = 0
+        self.raids = 0
+
+    def record(self, guild_id: int, member_id: int, account_age: float, threshold: int, window: float,
+               min_age: float, now: Optional[float] = None) -> Tuple[bool, List[int]]:
+        self.joins += 1
+        now = time.monotonic() if now is None else now
+        g = self._guilds.get(guild_id)
+        if g is None:
+            g = self._guilds[guild_id] = _GuildJoins()
+        joins, hist = g.joins, g.hist
+        cutoff = now - window
+        while joins and (joins[0][0] <= cutoff or len(joins) >= self.max_joins):
+            hist[joins.popleft()[3]] -= 1
+        b = bisect.bisect_right(ACCOUNT_AGE_BINS, account_age)
+        joins.append((now, member_id, account_age, b))
+        hist[b] += 1
+        if len(joins) >= threshold:
+            started = now >= g.raid_until
+            g.raid_until = now + self.cooldown
+            if started:
+                self.raids += 1
+                g.raid_started = now
+                return True, [mid for _, mid, age, _ in joins if age < min_age]
+        if now < g.raid_until and account_age < min_age:
+            return False, [member_id]
+        return False, []
+
+    def raid_active(self, guild_id: int, now: Optional[float] = None) -> bool:
+        g = self._guilds.get(guild_id)
+        return g is not None and (time.monotonic() if now is None else now) < g.raid_until
+
+    def describe(self, guild_id: int) -> str:
+        g = self._guilds.get(guild_id)
+        if g is None or not g.joins:
+            return "no recent joins"
+        return " · ".join(f"{label} {n}" for label, n in zip(ACCOUNT_AGE_LABELS, g.hist) if n)
+
+    def recent_count(self, guild_id: int) -> int:
+        g = self._guilds.get(guild_id)
+        return len(g.joins) if g else 0
+
+    def forget_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+
+join_monitor = JoinRateMonitor()
+
+
+class RaidContainment:
+    """Per-guild queue of flagged joiners, contained in bulk under a request budget.
+
+    ``submit`` only queues ids (deduplicated per guild). A worker, started on demand,
+    drains the queue in rounds: ``ban`` uses Discord's bulk ban (up to 200 members per
+    request), ``timeout`` runs up to ``concurrency`` member edits at once. Each guild
+    stays under ``rate`` requests per second, and all requests go through the REST
+    scheduler at containment priority. When the queue is empty a summary is logged.
+    Without the permission a mode needs nothing is sent (every call would be a 403);
+    the skipped joiners are reported instead, at most once per ``RAID_COOLDOWN``.
+    """
+
+    BULK_BAN_MAX = 200
+    PERMISSIONS = {"ban": ("ban_members", "Ban Members"), "timeout": ("moderate_members", "Timeout Members")}
+
+    def __init__(self, rate: float = RAID_ACTIONS_PER_SEC, concurrency: int = RAID_ACTION_CONCURRENCY):
+        self.rate = rate
+        self.concurrency = concurrency
+        self._queues: Dict[int, deque] = {}
+        self._queued: Dict[int, set] = {}
+        self._guilds: Dict[int, Any] = {}
+        self._modes: Dict[int, Tuple[str, int]] = {}
+        self._results: Dict[int, Dict[str, int]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._warned: Dict[int, float] = {}
+        # metrics
+        self.submitted = 0
+        self.contained = 0
+        self.failed = 0
+        self.skipped = 0
+        self.requests = 0
+
+    def _missing_permission(self, guild: Any, mode: str) -> Optional[str]:
+        attr, label = self.PERMISSIONS.get(mode, (None, None))
+        me = guild.me
+        if attr is None or me is None or getattr(me.guild_permissions, attr):
+            return None
+        return label
+
+    def _report_missing(self, guild: Any, missing: str, count: int) -> None:
+        now = time.monotonic()
+        last = self._warned.get(guild.id)
+        if last is not None and now - last < RAID_COOLDOWN:
+            return
+        self._warned[guild.id] = now
+        embed = discord.Embed(title="Guardian — Join Raid Not Contained", color=discord.Color.red(), timestamp=utc_now(),
+                              description=f"Missing the **{missing}** permission: {count} flagged joiners were left alone.")
+        send_log_embed(guild, embed)
+
+    def submit(self, guild: Any, member_ids: List[int], mode: str, timeout_minutes: int = 60) -> None:
+        missing = self._missing_permission(guild, mode)
+        if missing is not None:
+            self.skipped += len(member_ids)
+            self._report_missing(guild, missing, len(member_ids))
+            return
+        q = self._queues.get(guild.id)
+        if q is None:
+            q = self._queues[guild.id] = deque()
+            self._queued[guild.id] = set()
+        queued = self._queued[guild.id]
+        for mid in member_ids:
+            if mid not in queued:
+                queued.add(mid)
+                q.append(mid)
+                self.submitted += 1
+        self._guilds[guild.id] = guild
+        self._modes[guild.id] = (mode, timeout_minutes)
+        worker = self._workers.get(guild.id)
+        if worker is None or worker.done():
+            self._workers[guild.id] = asyncio.create_task(self._drain(guild.id), name=f"guardian-raid-{guild.id}")
+
+    def pending(self, guild_id: int) -> int:
+        return len(self._queues.get(guild_id) or ())
+
+    async def _ban(self, guild: Any, ids: List[int], result: Dict[str, int]) -> None:
+        self.requests += 1
+        try:
+            res = await rest.run(RestPriority.CONTAINMENT, guild.bulk_ban, [discord.Object(id=i) for i in ids],
+                                 reason="Guardian join raid containment", delete_message_seconds=86400)
+            result["contained"] += len(res.banned)
+            result["failed"] += len(res.failed)
+        except Exception as e:
+            print("raid bulk ban failed:", e)
+            result["failed"] += len(ids)
+
+    async def _timeout(self, guild: Any, mid: int, minutes: int, result: Dict[str, int]) -> None:
+        member = await member_resolver.resolve(guild, mid)
+        if member is None:  # already left
+            return
+        self.requests += 1
+        try:
+            await rest.run(RestPriority.CONTAINMENT, member.timeout, datetime.timedelta(minutes=minutes),
+                           reason="Guardian join raid containment")
+            result["contained"] += 1
+        except Exception:
+            result["failed"] += 1
+
+    async def _drain(self, guild_id: int) -> None:
+        guild = self._guilds[guild_id]
+        q = self._queues[guild_id]
+        result = self._results.setdefault(guild_id, {"contained": 0, "failed": 0})
+        started = time.monotonic()
+        missing = None
+        try:
+            while q:
+                mode, minutes = self._modes[guild_id]
+                missing = self._missing_permission(guild, mode)
+                if missing is not None:  # permission removed mid-raid
+                    result["failed"] += len(q)
+                    q.clear()
+                    break
+                size = self.BULK_BAN_MAX if mode == "ban" else self.concurrency
+                batch = [q.popleft() for _ in range(min(size, len(q)))]
+                t0 = time.monotonic()
+                if mode == "ban":
+                    await self._ban(guild, batch, result)
+                    rounds = 1
+                else:
+                    await asyncio.gather(*(self._timeout(guild, mid, minutes, result) for mid in batch))
+                    rounds = len(batch)
+                # stay within the per-guild request budget
+                wait = rounds / self.rate - (time.monotonic() - t0)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        finally:
+            self._workers.pop(guild_id, None)
+            self._results.pop(guild_id, None)
+            self._queued.pop(guild_id, None)
+            self._queues.pop(guild_id, None)
+            self.contained += result["contained"]
+            self.failed += result["failed"]
+            timings.record("stage:raid_containment", time.monotonic() - started, guild_id)
+        settings = _db.get(str(guild_id))
+        if settings is not None and (result["contained"] or result["failed"]):
+            embed = discord.Embed(title="Guardian — Join Raid Contained", color=discord.Color.red(), timestamp=utc_now())
+            embed.add_field(name="Action", value=self._modes[guild_id][0], inline=True)
+            embed.add_field(name="Contained", value=str(result["contained"]), inline=True)
+            embed.add_field(name="Failed", value=str(result["failed"]), inline=True)
+            embed.add_field(name="Duration", value=f"{time.monotonic() - started:.1f}s", inline=True)
+            if missing is not None:
+                embed.add_field(name="Stopped", value=f"Missing the {missing} permission", inline=False)
+            send_log_embed(guild, embed)
+
+    def forget_guild(self, guild_id: int) -> None:
+        worker = self._workers.pop(guild_id, None)
+        if worker is not None:
+            worker.cancel()
+        for d in (self._queues, self._queued, self._guilds, self._modes, self._results, self._warned):
+            d.pop(guild_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"submitted": self.submitted, "contained": self.contained, "failed": self.failed,
+                "skipped": self.skipped, "requests": self.requests, "active_guilds": len(self._workers),
+                "queued": sum(len(q) for q in self._queues.values())}
+
+
+raid_containment = RaidContainment()
+
+
+async def handle_member_join_rate(member: discord.Member) -> None:
+    guild = member.guild
+    cs = guild_settings(guild.id)
+    if not cs.guard_enabled or not cs.join_rate:
+        return
+    settings = _db[str(guild.id)]
+    age = (utc_now() - member.created_at).total_seconds()
+    window = cs.join_window
+    started, flagged = join_monitor.record(guild.id, member.id, age, cs.join_threshold, window, cs.min_account_age)
+    action = cs.raid_action
+    if started:
+        embed = discord.Embed(title="Guardian — Join Raid Detected", color=discord.Color.red(), timestamp=utc_now())
+        embed.add_field(name="Join rate", value=f"{join_monitor.recent_count(guild.id)} joins in {window:g}s", inline=True)
+        embed.add_field(name="Flagged", value=str(len(flagged)), inline=True)
+        embed.add_field(name="Response", value=action, inline=True)
+        embed.add_field(name="Account ages", value=join_monitor.describe(guild.id), inline=False)
+        send_log_embed(guild, embed)
+    if not flagged or action == "none":
+        return
+    contain = []
+    for mid in flagged:
+        m = member_resolver.get(guild, mid)
+        if m is None or not is_whitelisted(settings, "antinuke", m):
+            contain.append(mid)
+    if contain:
+        raid_containment.submit(guild, contain, action, cs.timeout_minutes)
 
 
 # ---------------- EVENT HANDLERS ----------------
 @bot.event
-async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
-    guild = channel.guild
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False) or not settings.get("antinuke", {}).get("channels_deleted", False):
+@tracked
+async def on_audit_log_entry_create(entry: discord.AuditLogEntry):
+    audit_index.feed(entry)
+
+
+@bot.event
+@tracked
+async def on_guild_remove(guild: discord.Guild):
+    audit_index.forget_guild(guild.id)
+    audit_fetcher.forget_guild(guild.id)
+    trigger_limiter.forget_guild(guild.id)
+    spam_notice_limiter.forget_guild(guild.id)
+    invalidate_link_matcher(guild.id)
+    spam_detector.forget_guild(guild.id)
+    forget_guild_settings(guild.id)
+    timings.forget_guild(guild.id)
+    nuke_scorer.forget_guild(guild.id)
+    join_monitor.forget_guild(guild.id)
+    raid_containment.forget_guild(guild.id)
+    panel_refresher.forget(guild.id)
+    whitelist_index.invalidate_guild(guild.id)
+    admin_index.invalidate(guild.id)
+    member_resolver.forget_guild(guild.id)
+
+
+@bot.event
+@tracked
+async def on_guild_update(before: discord.Guild, after: discord.Guild):
+    if before.owner_id != after.owner_id:
+        whitelist_index.invalidate_guild(after.id)
+
+
+@bot.event
+@tracked
+async def on_member_update(before: discord.Member, after: discord.Member):
+    whitelist_index.invalidate_member(after.guild.id, after.id)
+    if before.roles != after.roles:
+        admin_index.update_member(after)
+
+
+@bot.event
+@tracked
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    whitelist_index.invalidate_guild(after.guild.id)
+    if before.permissions.administrator != after.permissions.administrator:
+        admin_index.invalidate(after.guild.id)
+
+
+async def handle_antinuke_event(guild: discord.Guild, category: str, action: discord.AuditLogAction, target: Any,
+                                target_id: Optional[int] = None, require_actor: bool = False) -> None:
+    cs = guild_settings(guild.id)
+    if not cs.guard_enabled:
+        return
+    direct = category in cs.antinuke
+    scoring = cs.nuke_scoring
+    if not direct and not scoring:
         return
-    actor = await fetch_audit_actor(guild, discord.AuditLogAction.channel_delete)
+    settings = _db[str(guild.id)]
+    # require_actor events (member removals) are driven by the gateway audit feed alone:
+    # a plain leave or prune has no entry and must not cost an audit-log fetch
+    t0 = time.perf_counter()
+    actor = await resolve_audit_actor(guild, action, target_id=target_id, rest_fallback=not require_actor)
+    if actor is not None and guild.me is not None and actor.id == guild.me.id:
+        # our own raid bans and punishments come back as these events too; never score or punish them
+        return
+    if actor is not None and not isinstance(actor, discord.Member):
+        # outside the member cache: whitelist checks and punishments need the full member
+        actor = await member_resolver.resolve(guild, actor.id) or actor
+    timings.record("stage:audit_lookup", time.perf_counter() - t0, guild.id)
     if actor and isinstance(actor, discord.Member) and is_whitelisted(settings, "antinuke", actor):
         return
-    await perform_punishments(guild, actor if isinstance(actor, discord.Member) else None, "channels_deleted", channel, settings)
+    if require_actor and not actor:
+        return
+    member = actor if isinstance(actor, discord.Member) else None
+    if direct:
+        await perform_punishments(guild, member, category, target, settings)
+    if scoring and actor is not None:
+        if nuke_scorer.record(guild.id, actor.id, category, cs.score_threshold):
+            await perform_punishments(guild, member, "nuke_score", target, settings,
+                                      details=nuke_scorer.describe(guild.id, actor.id))
 
 
 @bot.event
+@tracked
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    await handle_antinuke_event(channel.guild, "channels_deleted", discord.AuditLogAction.channel_delete, channel, target_id=channel.id)
+
+
+@bot.event
+@tracked
 async def on_guild_channel_create(channel: discord.abc.GuildChannel):
-    guild = channel.guild
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False) or not settings.get("antinuke", {}).get("channels_created", False):
-        return
-    actor = await fetch_audit_actor(guild, discord.AuditLogAction.channel_create)
-    if actor and isinstance(actor, discord.Member) and is_whitelisted(settings, "antinuke", actor):
-        return
-    await perform_punishments(guild, actor if isinstance(actor, discord.Member) else None, "channels_created", channel, settings)
+    await handle_antinuke_event(channel.guild, "channels_created", discord.AuditLogAction.channel_create, channel, target_id=channel.id)
 
 
 @bot.event
+@tracked
 async def on_guild_role_delete(role: discord.Role):
     guild = role.guild
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False) or not settings.get("antinuke", {}).get("roles_deleted", False):
-        return
-    actor = await fetch_audit_actor(guild, discord.AuditLogAction.role_delete)
-    if actor and isinstance(actor, discord.Member) and is_whitelisted(settings, "antinuke", actor):
-        return
-    await perform_punishments(guild, actor if isinstance(actor, discord.Member) else None, "roles_deleted", role, settings)
+    whitelist_index.invalidate_guild(guild.id)
+    if role.permissions.administrator:
+        admin_index.invalidate(guild.id)
+    await handle_antinuke_event(guild, "roles_deleted", discord.AuditLogAction.role_delete, role, target_id=role.id)
 
 
 @bot.event
+@tracked
 async def on_guild_role_create(role: discord.Role):
-    guild = role.guild
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False) or not settings.get("antinuke", {}).get("roles_created", False):
-        return
-    actor = await fetch_audit_actor(guild, discord.AuditLogAction.role_create)
-    if actor and isinstance(actor, discord.Member) and is_whitelisted(settings, "antinuke", actor):
-        return
-    await perform_punishments(guild, actor if isinstance(actor, discord.Member) else None, "roles_created", role, settings)
+    await handle_antinuke_event(role.guild, "roles_created", discord.AuditLogAction.role_create, role, target_id=role.id)
 
 
 @bot.event
+@tracked
 async def on_webhooks_update(channel: discord.abc.GuildChannel):
-    guild = channel.guild
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False) or not settings.get("antinuke", {}).get("webhooks_created", False):
-        return
-    actor = await fetch_audit_actor(guild, discord.AuditLogAction.webhook_create)
-    if actor and isinstance(actor, discord.Member) and is_whitelisted(settings, "antinuke", actor):
-        return
-    await perform_punishments(guild, actor if isinstance(actor, discord.Member) else None, "webhooks_created", channel, settings)
+    await handle_antinuke_event(channel.guild, "webhooks_created", discord.AuditLogAction.webhook_create, channel)
 
 
 @bot.event
+@tracked
 async def on_member_ban(guild: discord.Guild, user: discord.User):
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False) or not settings.get("antinuke", {}).get("member_bans", False):
-        return
-    actor = await fetch_audit_actor(guild, discord.AuditLogAction.ban, target_id=user.id)
-    if actor and isinstance(actor, discord.Member) and is_whitelisted(settings, "antinuke", actor):
-        return
-    await perform_punishments(guild, actor if isinstance(actor, discord.Member) else None, "member_bans", user, settings)
+    await handle_antinuke_event(guild, "member_bans", discord.AuditLogAction.ban, user, target_id=user.id)
 
 
 @bot.event
-async def on_member_remove(member: discord.Member):
-    guild = member.guild
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False) or not settings.get("antinuke", {}).get("member_kicks", False):
-        return
-    actor = await fetch_audit_actor(guild, discord.AuditLogAction.kick, target_id=member.id)
-    if actor and isinstance(actor, discord.Member) and is_whitelisted(settings, "antinuke", actor):
+@tracked
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    # raw: member_remove is only dispatched for members in the client cache
+    guild = bot.get_guild(payload.guild_id)
+    if guild is None:
         return
-    if actor:
-        await perform_punishments(guild, actor if isinstance(actor, discord.Member) else None, "member_kicks", member, settings)
+    user = payload.user
+    whitelist_index.invalidate_member(guild.id, user.id)
+    admin_index.remove_member(guild.id, user.id)
+    member_resolver.forget(guild.id, user.id)
+    # only an actual kick counts: the gateway kick entry, never a REST lookup, decides
+    await handle_antinuke_event(guild, "member_kicks", discord.AuditLogAction.kick, user, target_id=user.id, require_actor=True)
 
 
 @bot.event
+@tracked
 async def on_member_join(member: discord.Member):
-    guild = member.guild
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False):
-        return
+    if not member_cache.joined:
+        # the client cache drops joiners; raid containment may still need them
+        member_resolver.remember(member)
     # detect bots added
-    if member.bot and settings.get("antinuke", {}).get("bots_added", False):
-        actor = await fetch_audit_actor(guild, discord.AuditLogAction.bot_add, target_id=member.id)
-        if actor and isinstance(actor, discord.Member) and is_whitelisted(settings, "antinuke", actor):
-            return
-        await perform_punishments(guild, actor if isinstance(actor, discord.Member) else None, "bots_added", member, settings)
+    if member.bot:
+        await handle_antinuke_event(member.guild, "bots_added", discord.AuditLogAction.bot_add, member, target_id=member.id)
+    else:
+        await handle_member_join_rate(member)
 
 
 @bot.event
+@tracked
 async def on_message(message: discord.Message):
     if message.author.bot or not message.guild:
         return
     guild = message.guild
-    ensure_guild_data(guild.id)
-    sid = str(guild.id)
-    settings = _db[sid]
-    if not settings.get("guard_enabled", False):
+    cs = guild_settings(guild.id)
+    if not cs.guard_enabled:
         return
+    settings = _db[str(guild.id)]
     author = message.author
     # automod whitelist skip
     if is_whitelisted(settings, "automod", author):
         await bot.process_commands(message)
         return
-    am = settings.get("automod", {})
     # link/invite filter
-    if am.get("link_invite_filter", False):
-        content = message.content.lower()
-        if "discord.gg/" in content or "discord.com/invite" in content or "http://" in content or "https://" in content:
+    if cs.link_filter:
+        hit = get_link_matcher(guild.id, settings.get("automod", {})).scan(message.content)
+        if hit:
             try:
                 await message.delete()
             except Exception:
@@ -734,13 +3553,13 @@ async def on_message(message: discord.Message):
             embed = discord.Embed(title="Guardian — AutoMod Link Blocked", color=discord.Color.orange(), timestamp=utc_now())
             embed.add_field(name="User", value=f"{author} ({author.id})", inline=True)
             embed.add_field(name="Channel", value=message.channel.mention, inline=True)
+            embed.add_field(name="Reason", value=f"{hit[0]} ({hit[1]})"[:1024], inline=True)
             embed.add_field(name="Content", value=(message.content[:1024] or "(empty)"), inline=False)
-            await send_log_embed(guild, embed, settings)
+            send_log_embed(guild, embed)
             return
     # mass mention protection
-    if am.get("mass_mention_protection", False):
-        thr = int(am.get("mass_mention_threshold", 5))
-        if len(message.mentions) >= thr:
+    if cs.mass_mention:
+        if len(message.mentions) >= cs.mass_mention_threshold:
             try:
                 await message.delete()
             except Exception:
@@ -749,38 +3568,434 @@ async def on_message(message: discord.Message):
             embed.add_field(name="User", value=f"{author} ({author.id})", inline=True)
             embed.add_field(name="Channel", value=message.channel.mention, inline=True)
             embed.add_field(name="Mentions", value=str(len(message.mentions)), inline=False)
-            await send_log_embed(guild, embed, settings)
+            send_log_embed(guild, embed)
+            return
+    # copy-paste floods
+    if cs.spam:
+        reason = spam_detector.check(guild.id, message.channel.id, author.id, message.content,
+                                     cs.spam_threshold, cs.spam_channel_threshold)
+        if reason:
+            try:
+                await message.delete()
+            except Exception:
+                pass
+            # one report per user per window; later copies are just deleted
+            if spam_notice_limiter.allows(guild.id, str(author.id), window_seconds=SPAM_WINDOW, limit=1):
+                embed = discord.Embed(title="Guardian — AutoMod Spam", color=discord.Color.orange(), timestamp=utc_now())
+                embed.add_field(name="User", value=f"{author} ({author.id})", inline=True)
+                embed.add_field(name="Channel", value=message.channel.mention, inline=True)
+                embed.add_field(name="Reason", value=reason, inline=True)
+                embed.add_field(name="Content", value=(message.content[:1024] or "(empty)"), inline=False)
+                send_log_embed(guild, embed)
             return
     await bot.process_commands(message)
 
 
-# ---------------- KEEP-ALIVE (Flask) ----------------
-app = Flask("guardian-keepalive")
-
-
-@app.route("/", methods=["GET"])
-def home():
-    return jsonify({"status": "ok", "ts": utc_now().isoformat()})
+# ---------------- HEALTH + METRICS SERVER ----------------
+class LoopLagMonitor:
+    """Measures event-loop lag as the overshoot of a periodic sleep."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="guardian-loop-lag")
+
+    async def _run(self) -> None:
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - t0 - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            loop_lag_seconds.observe(lag)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+loop_lag = LoopLagMonitor()
+_started_at = time.monotonic()
+
+
+def _latency_ms(value: float) -> Optional[float]:
+    # discord.py reports inf/nan until the first heartbeat ack
+    return round(value * 1000, 1) if value == value and value != float("inf") else None
+
+
+def shard_status() -> List[Dict[str, Any]]:
+    shards = getattr(bot, "shards", None)
+    if shards:  # AutoShardedBot
+        return [{"id": sid, "latency_ms": _latency_ms(info.latency), "closed": info.is_closed(),
+                 "ws_ratelimited": info.is_ws_ratelimited()} for sid, info in sorted(shards.items())]
+    return [{"id": bot.shard_id or 0, "latency_ms": _latency_ms(bot.latency), "closed": bot.is_closed(),
+             "ws_ratelimited": bot.is_ws_ratelimited() if bot.ws is not None else False}]
+
+
+_unhealthy_since: Optional[float] = None
+
+
+def health_report() -> Tuple[int, Dict[str, Any]]:
+    global _unhealthy_since
+    ready = bot.is_ready()
+    shards = shard_status()
+    now = time.monotonic()
+    # a lag spike or a shard resuming is normal; only a condition that persists makes us degraded
+    if ready and (loop_lag.last > HEALTH_MAX_LOOP_LAG or any(s["closed"] for s in shards)):
+        if _unhealthy_since is None:
+            _unhealthy_since = now
+    else:
+        _unhealthy_since = None
+    if bot.is_closed():
+        status = "closed"
+    elif not ready:
+        status = "starting"
+    elif _unhealthy_since is not None and now - _unhealthy_since >= HEALTH_DEGRADED_AFTER:
+        status = "degraded"
+    else:
+        status = "ok"
+    body = {
+        "status": status,
+        "unhealthy_s": round(now - _unhealthy_since, 1) if _unhealthy_since is not None else 0.0,
+        "cluster": CLUSTER_ID or None,
+        "ts": utc_now().isoformat(),
+        "uptime_s": round(time.monotonic() - _started_at, 1),
+        "latency_ms": _latency_ms(bot.latency),
+        "loop_lag_ms": round(loop_lag.last * 1000, 1),
+        "loop_lag_max_ms": round(loop_lag.max * 1000, 1),
+        "shards": shards,
+        "guilds": len(bot.guilds),
+        "log_queue": log_pipeline.queue_depth(),
+        "config_pending": persister.stats()["pending"],
+        "lockdowns": lockdown_engine.running(),
+    }
+    return (503 if status in ("closed", "degraded") else 200), body
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    code, body = health_report()
+    return web.json_response(body, status=code)
+
+
+async def handle_live(request: web.Request) -> web.Response:
+    # keep-alive pings and platform liveness checks: answering at all means the loop is running
+    return web.json_response({"status": "alive", "uptime_s": round(time.monotonic() - _started_at, 1)})
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Version": "0.0.4"})
+
+
+def _register_gauges() -> None:
+    metrics.gauge("guardian_gateway_latency_seconds", "Gateway heartbeat latency per shard",
+                  lambda: [((s["id"],), None if s["latency_ms"] is None else s["latency_ms"] / 1000) for s in shard_status()],
+                  ("shard",))
+    metrics.gauge("guardian_shard_up", "1 if the shard's websocket is open",
+                  lambda: [((s["id"],), 0 if s["closed"] else 1) for s in shard_status()], ("shard",))
+    metrics.gauge("guardian_loop_lag_last_seconds", "Most recent event-loop lag sample", lambda: loop_lag.last)
+    metrics.gauge("guardian_guilds", "Guilds the bot is in", lambda: len(bot.guilds))
+    metrics.gauge("guardian_log_queue_depth", "Queued log embeds across guilds", lambda: log_pipeline.queue_depth())
+    metrics.gauge("guardian_config_pending_guilds", "Guilds with unflushed config changes",
+                  lambda: persister.stats()["pending"])
+    metrics.gauge("guardian_rest_queue_depth", "REST actions waiting per priority",
+                  lambda: [((name,), st["depth"]) for name, st in rest.stats().items()], ("priority",))
+    metrics.gauge("guardian_audit_rest_avoided_total", "Member removals resolved without a REST audit-log fetch",
+                  lambda: audit_index.rest_avoided, kind="counter")
+    metrics.gauge("guardian_member_fetches_total", "Members fetched over REST after a client cache miss",
+                  lambda: member_resolver.fetches, kind="counter")
+    metrics.gauge("guardian_member_lru_entries", "Members held by the on-demand member LRU",
+                  lambda: member_resolver.stats()["entries"])
+    metrics.gauge("guardian_interaction_ack_over_budget_total", "Panel interactions acknowledged after the ack budget",
+                  lambda: ack_stats.over_budget, kind="counter")
+
+
+_register_gauges()
+
+
+class HealthServer:
+    """aiohttp server on the bot's own loop: ``/`` (liveness), ``/health`` (JSON) and ``/metrics`` (Prometheus).
+
+    ``/`` is the keep-alive URL hosting platforms poll, so it answers 200 whenever the
+    process is up; only ``/health`` reports degraded. The cluster launcher runs one with
+    its own health and metrics handlers, which aggregate the workers' servers.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = KEEP_ALIVE_PORT, health_handler=handle_health,
+                 metrics_handler=handle_metrics, live_handler=handle_live):
+        self.host = host
+        self.port = port
+        self.live_handler = live_handler
+        self.health_handler = health_handler
+        self.metrics_handler = metrics_handler
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.add_routes([web.get("/", self.live_handler), web.get("/health", self.health_handler),
+                        web.get("/metrics", self.metrics_handler)])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"Health server listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+health_server = HealthServer()
+
+
+# ---------------- CLUSTER LAUNCHER ----------------
+DISCORD_API = "https://discord.com/api/v10"
+
+
+async def gateway_info(token: str) -> Tuple[int, int]:
+    """Discord's recommended shard count and how many shards may identify per 5 seconds."""
+    async with ClientSession(timeout=ClientTimeout(total=15)) as session:
+        async with session.get(f"{DISCORD_API}/gateway/bot", headers={"Authorization": f"Bot {token}"}) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    return int(data["shards"]), int(data.get("session_start_limit", {}).get("max_concurrency", 1))
+
+
+def shard_ranges(shard_count: int, workers: int) -> List[List[int]]:
+    # contiguous, near-equal ranges; never more workers than shards
+    workers = max(1, min(workers, shard_count))
+    return [list(range(i * shard_count // workers, (i + 1) * shard_count // workers)) for i in range(workers)]
+
+
+def merge_prometheus(texts: Dict[str, str], label: str = "cluster") -> str:
+    """Merge several /metrics bodies into one, tagging each sample with ``label="<source>"``.
 
+    HELP/TYPE lines are emitted once per family, followed by every source's samples of it.
+    """
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for source, text in texts.items():
+        tag = f'{label}="{_prom_escape(source)}"'
+        family = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = parts[2]
+                    seen = headers.setdefault(family, [])
+                    if line not in seen:
+                        seen.append(line)
+                continue
+            name, brace, rest = line.partition("{")
+            if brace:
+                line = f"{name}{{{tag}{'' if rest.startswith('}') else ','}{rest}"
+            else:
+                name, _, value = line.partition(" ")
+                line = f"{name}{{{tag}}} {value}"
+            samples.setdefault(family or name, []).append(line)
+    out: List[str] = []
+    for family in dict.fromkeys([*headers, *samples]):
+        out.extend(headers.get(family, ()))
+        out.extend(samples.get(family, ()))
+    return "\n".join(out) + "\n"
+
+
+class ClusterWorker:
+    """One bot process running a contiguous shard range; restarted with backoff whenever it exits."""
+
+    def __init__(self, index: int, shards: List[int], shard_count: int, port: int):
+        self.name = f"cluster-{index}"
+        self.shards = shards
+        self.shard_count = shard_count
+        self.port = port
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+
+    def env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "CLUSTER_ID": self.name,
+            "CLUSTER_WORKERS": "0",
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": f"{self.shards[0]}-{self.shards[-1]}",
+            "PORT": str(self.port),
+        })
+        return env
+
+    async def run(self, stopping: asyncio.Event, start_delay: float = 0.0) -> None:
+        delay = CLUSTER_RESTART_DELAY
+        if start_delay:
+            await asyncio.sleep(start_delay)
+        while not stopping.is_set():
+            started = time.monotonic()
+            self.proc = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), env=self.env())
+            print(f"{self.name}: started pid {self.proc.pid} for shards {self.shards[0]}-{self.shards[-1]}")
+            code = await self.proc.wait()
+            if stopping.is_set():
+                return
+            # a worker that stayed up for a while gets a fresh backoff
+            if time.monotonic() - started > 600:
+                delay = CLUSTER_RESTART_DELAY
+            print(f"{self.name}: exited with {code}, restarting in {delay:g}s")
+            self.restarts += 1
+            try:
+                await asyncio.wait_for(stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, 300.0)
 
-def run_flask() -> None:
-    host = "0.0.0.0"
-    port = KEEP_ALIVE_PORT
-    # debug False, threaded True is fine for tiny keep-alive
-    app.run(host=host, port=port, threaded=True)
+    async def stop(self, timeout: float = 30.0) -> None:
+        # SIGTERM lets the worker run its final config flush
+        proc = self.proc
+        if proc is None or proc.returncode is not None:
+            return
+        proc.terminate()
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+
+class Cluster:
+    """The launcher's view of its workers: supervision plus aggregated ``/health`` and ``/metrics``."""
+
+    def __init__(self, workers: List[ClusterWorker], shard_count: int):
+        self.workers = workers
+        self.shard_count = shard_count
+        self.stopping = asyncio.Event()
+        self._session: Optional[ClientSession] = None
+        self.metrics = MetricsRegistry()
+        self.metrics.gauge("guardian_cluster_worker_up", "1 if the worker process is running",
+                           lambda: [((w.name,), int(w.proc is not None and w.proc.returncode is None)) for w in self.workers],
+                           ("cluster",))
+        self.metrics.gauge("guardian_cluster_worker_restarts_total", "Times the worker process was restarted",
+                           lambda: [((w.name,), w.restarts) for w in self.workers], ("cluster",), kind="counter")
+
+    async def _get(self, worker: ClusterWorker, path: str) -> Optional[Tuple[int, str]]:
+        if self._session is None:
+            self._session = ClientSession(timeout=ClientTimeout(total=5))
+        try:
+            async with self._session.get(f"http://127.0.0.1:{worker.port}{path}") as resp:
+                return resp.status, await resp.text()
+        except Exception:
+            return None
+
+    async def health(self) -> Tuple[int, Dict[str, Any]]:
+        results = await asyncio.gather(*(self._get(w, "/health") for w in self.workers))
+        clusters = {}
+        for w, res in zip(self.workers, results):
+            body = json.loads(res[1]) if res is not None else {"status": "down"}
+            body["shard_ids"] = w.shards
+            body["restarts"] = w.restarts
+            clusters[w.name] = body
+        statuses = {c["status"] for c in clusters.values()}
+        if statuses == {"ok"}:
+            status = "ok"
+        elif statuses <= {"ok", "starting"}:
+            status = "starting"
+        else:
+            status = "degraded"
+        body = {
+            "status": status,
+            "ts": utc_now().isoformat(),
+            "uptime_s": round(time.monotonic() - _started_at, 1),
+            "shard_count": self.shard_count,
+            "guilds": sum(c.get("guilds", 0) for c in clusters.values()),
+            "clusters": clusters,
+        }
+        return (503 if status == "degraded" else 200), body
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        code, body = await self.health()
+        return web.json_response(body, status=code)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        results = await asyncio.gather(*(self._get(w, "/metrics") for w in self.workers))
+        texts = {w.name: res[1] for w, res in zip(self.workers, results) if res is not None and res[0] == 200}
+        return web.Response(text=merge_prometheus(texts) + self.metrics.render(), content_type="text/plain",
+                            charset="utf-8", headers={"X-Prometheus-Version": "0.0.4"})
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+async def run_cluster() -> None:
+    """Spread the shards over CLUSTER_WORKERS processes, supervise them and aggregate their health."""
+    if not TOKEN:
+        raise RuntimeError("Set TOKEN environment variable with your bot token")
+    if STORAGE_BACKEND != "sqlite":
+        raise RuntimeError("CLUSTER_WORKERS needs STORAGE_BACKEND=sqlite (workers share the database)")
+    try:
+        recommended, concurrency = await gateway_info(TOKEN)
+    except Exception as e:
+        if not SHARD_COUNT:
+            raise RuntimeError(f"Could not get the recommended shard count; set SHARD_COUNT ({e})")
+        recommended, concurrency = SHARD_COUNT, 1
+    shard_count = SHARD_COUNT or recommended
+    # create (and migrate into) the shared database once, before the workers open it
+    await storage.load_all(lambda gid: False)
+    await storage.close()
+    ranges = shard_ranges(shard_count, CLUSTER_WORKERS)
+    cluster = Cluster([ClusterWorker(i, ids, shard_count, CLUSTER_BASE_PORT + i) for i, ids in enumerate(ranges)],
+                      shard_count)
+    print(f"Cluster: {shard_count} shards over {len(ranges)} workers")
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, cluster.stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    server = HealthServer(port=KEEP_ALIVE_PORT, health_handler=cluster.handle_health,
+                          metrics_handler=cluster.handle_metrics)
+    try:
+        await server.start()
+    except OSError as e:
+        print("Cluster health server failed to start:", e)
+    # identify is limited to max_concurrency shards per 5s across the whole bot, so stagger first starts
+    tasks, start_at = [], 0.0
+    for w in cluster.workers:
+        tasks.append(asyncio.create_task(w.run(cluster.stopping, start_at), name=f"guardian-{w.name}"))
+        start_at += 5.0 * -(-len(w.shards) // concurrency)
+    try:
+        await cluster.stopping.wait()
+    finally:
+        cluster.stopping.set()
+        await asyncio.gather(*(w.stop() for w in cluster.workers))
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await server.stop()
+        await cluster.close()
 
 
 # ---------------- STARTUP ----------------
 @bot.event
+@tracked
 async def on_ready():
-    await load_config()
+    # config is loaded once in main(); reloading here would drop unflushed write-behind changes
     print(f"Logged in as {bot.user} ({bot.user.id}) — guilds: {len(bot.guilds)}")
-    # sync commands
-    try:
-        await tree.sync()
-        print("Slash commands synced.")
-    except Exception as e:
-        print("Failed to sync commands:", e)
+    # sync commands (global, so in a cluster only the worker running shard 0 does it)
+    if _owned_shards is None or 0 in _owned_shards:
+        try:
+            await tree.sync()
+            print("Slash commands synced.")
+        except Exception as e:
+            print("Failed to sync commands:", e)
     # refresh any existing panels (best-effort)
     for gid, settings in list(_db.items()):
         if settings.get("panel_message"):
@@ -796,10 +4011,43 @@ async def on_ready():
                     pass
 
 
-if __name__ == "__main__":
-    # start keep-alive server (background)
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+async def main() -> None:
+    if not TOKEN:
+        raise RuntimeError("Set TOKEN environment variable with your bot token")
     # load config before running bot
-    asyncio.run(load_config())
-    bot.run(TOKEN)
+    await load_config()
+    # one stateless router serves every panel button, including panels sent before this start
+    bot.add_dynamic_items(PanelButton)
+    persister.start()
+    loop_lag.start()
+    profiler.start()
+    try:
+        await health_server.start()
+    except OSError as e:
+        print("Health server failed to start:", e)
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(bot.close()))
+    except (NotImplementedError, RuntimeError):
+        pass  # e.g. Windows; Ctrl+C still goes through the finally below
+    try:
+        async with bot:
+            await bot.start(TOKEN)
+    finally:
+        # guaranteed final flush of pending config changes
+        await health_server.stop()
+        await loop_lag.stop()
+        profiler.stop()
+        await background.drain()
+        await rest.close()
+        await persister.stop()
+        await storage.close()
+
+
+if __name__ == "__main__":
+    discord.utils.setup_logging()
+    try:
+        # CLUSTER_WORKERS > 0: this process only launches and supervises the workers
+        asyncio.run(run_cluster() if CLUSTER_WORKERS > 0 else main())
+    except KeyboardInterrupt:
+        pass